@@ -1,60 +1,159 @@
 #!/usr/bin/python
+from __future__ import print_function
+from collections import namedtuple
+from email.utils import mktime_tz, parsedate_tz
+import errno
 from getopt import getopt
+from hashlib import md5
+from io import FileIO
 from itertools import count
-from logging import getLogger, Formatter, FileHandler, StreamHandler, DEBUG, INFO, WARNING
-from re import match
-from os import fdopen, listdir, makedirs, remove
-from os.path import getmtime, getsize, isdir, isfile, join, lexists
+from json import dumps, loads
+from logging import getLogger, Filter, Formatter, Handler, StreamHandler, DEBUG, INFO, WARNING
+from logging.handlers import RotatingFileHandler
+from random import uniform
+from re import match, search
+from os import devnull, fdopen, fsync, getpid, listdir, makedirs, remove, rename, rmdir, stat, times, urandom
+from os.path import dirname, getmtime, getsize, isdir, isfile, islink, join, lexists, relpath, samefile, splitext
+from socket import gethostname
+from sqlite3 import connect
 from subprocess import Popen, PIPE, STDOUT
-from sys import argv, exit, getfilesystemencoding, platform, stdout # pylint: disable=W0622
-from time import sleep, time
+from sys import argv, executable, exit, getfilesystemencoding, platform, stdout, version_info # pylint: disable=W0622
+from threading import Condition, Event, Lock, Thread, local
+from time import localtime, sleep, strftime, time
 from traceback import format_exc
 
+isPython3 = version_info[0] > 2
+
+if isPython3:
+    from http.server import BaseHTTPRequestHandler, HTTPServer # pylint: disable=F0401
+    from queue import Queue, Empty # pylint: disable=F0401
+    from urllib.parse import quote # pylint: disable=E0611, F0401
+    unicode = str # pylint: disable=W0622
+    xrange = range # pylint: disable=W0622
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer # pylint: disable=F0401
+    from Queue import Queue, Empty # pylint: disable=F0401
+    from urllib import quote # pylint: disable=E0611
+
 # Console output encoding and buffering problems fixing
-stdout = fdopen(stdout.fileno(), 'w', 0)
+if isPython3:
+    stdout = open(stdout.fileno(), 'w', errors = 'replace', closefd = False)
+else:
+    stdout = fdopen(stdout.fileno(), 'w', 0)
 
-# ToDo: Report non-mentioned videos
 # ToDo: Verify already downloaded videos
 # ToDo: Do something to Knudepunkt TV problem
 # ToDo: Check video author, report it and do not attempt settings
 # ToDo: Gather all errors to re-display in the end
 
-try: # Selenium configuration
-    import selenium
-    if tuple(int(v) for v in selenium.__version__.split('.')) < (2, 45):
-        raise ImportError('Selenium version %s < 2.45' % selenium.__version__)
-    from selenium import webdriver
-    from selenium.common.exceptions import NoSuchElementException
-    DRIVERS = dict((v.lower(), (v, getattr(webdriver, v))) for v in vars(webdriver) if v[0].isupper()) # ToDo: Make this list more precise
-except ImportError, ex:
-    print "%s: %s\nERROR: This software requires Selenium.\nPlease install Selenium v2.45 or later: https://pypi.python.org/pypi/selenium\n" % (ex.__class__.__name__, ex)
-    exit(-1)
-
-try: # pycurl downloader library
-    import pycurl # required by urlgrabber # pylint: disable=W0611
-except ImportError, ex:
-    print "%s: %s\nERROR: This software requires pycurl.\nPlease install pycurl v7.19.3.1 or later: https://pypi.python.org/pypi/pycurl\n" % (ex.__class__.__name__, ex)
-    exit(-1)
-
-try: # urlgrabber downloader library, requires pycurl
-    import urlgrabber
-    from urlgrabber.grabber import URLGrabber, URLGrabError
-    if tuple(int(v) for v in urlgrabber.__version__.split('.')) < (3, 10):
-        if tuple(int(v) for v in urlgrabber.__version__.split('.')) < (3, 9, 1):
-            raise ImportError('urlgrabber version %s < 3.9.1' % urlgrabber.__version__)
-        else:
-            print "\nWARNING: You're using urlgrabber 3.9.1 which contains a known error.\nPlease use urlgrabber 3.10 or later whenever possible,\notherwise (on Windows) patch the urlgrabber source:\nLocate the file C:\\Python27\\Lib\\site-packages\\urlgrabber\\grabber.py\nand in line 1161 replace\nself.curl_obj.setopt(pycurl.SSL_VERIFYHOST, opts.ssl_verify_host)\nwith\nself.curl_obj.setopt(pycurl.SSL_VERIFYHOST, 0)\nSee https://ask.fedoraproject.org/en/question/35874/yum-pycurl-error-43/ for details.\n"
-except ImportError, ex:
-    print "%s: %s\nERROR: This software requires urlgrabber.\nPlease install urlgrabber v3.9.1 or later: https://pypi.python.org/pypi/urlgrabber\n" % (ex.__class__.__name__, ex)
-    exit(-1)
-
-try: # Requests HTTP library
-    import requests
-    if tuple(int(v) for v in requests.__version__.split('.')) < (2, 3, 0):
-        raise ImportError('Requests version %s < 2.3.0' % requests.__version__)
-except ImportError, ex:
-    requests = None
-    print "%s: %s\nWARNING: Video size information will not be available.\nPlease install Requests v2.3.0 or later: https://pypi.python.org/pypi/requests\n" % (ex.__class__.__name__, ex)
+# Backend libraries are imported on first use, so that --help, benchmarks
+# and queue workers don't pay for the browser and downloader imports
+webdriver = pycurl = caInfo = URLGrabber = requests = psutil = None
+requestsChecked = psutilChecked = False
+
+class NoSuchElementException(Exception):
+    '''Placeholder, replaced with the Selenium exception by importSelenium().'''
+
+class WebDriverException(Exception):
+    '''Placeholder, replaced with the Selenium exception by importSelenium().'''
+
+class URLGrabError(Exception):
+    '''Placeholder, replaced with the urlgrabber exception by importURLGrabber().'''
+
+def importSelenium():
+    '''Imports Selenium on first use, returns selenium.webdriver module.'''
+    global webdriver, NoSuchElementException, WebDriverException # pylint: disable=W0603
+    if not webdriver:
+        try:
+            import selenium
+            if tuple(int(v) for v in selenium.__version__.split('.')) < (2, 45):
+                raise ImportError('Selenium version %s < 2.45' % selenium.__version__)
+            from selenium import webdriver as module
+            from selenium.common.exceptions import NoSuchElementException as exception, WebDriverException as driverException
+        except ImportError as ex:
+            raise ImportError("%s: %s\nThis software requires Selenium.\nPlease install Selenium v2.45 or later: https://pypi.python.org/pypi/selenium" % (ex.__class__.__name__, ex))
+        (webdriver, NoSuchElementException, WebDriverException) = (module, exception, driverException)
+    return webdriver
+
+def getDriverClass(driverName):
+    '''Returns (name, class) of the Selenium WebDriver with the specified case-insensitive name.'''
+    module = importSelenium()
+    drivers = dict((v.lower(), (v, getattr(module, v))) for v in vars(module) if v[0].isupper()) # ToDo: Make this list more precise
+    driverTuple = drivers.get(driverName.lower())
+    if not driverTuple:
+        raise ValueError("Unknown driver %s, valid values are: %s" % (driverName, '/'.join(sorted(x[0] for x in drivers.values()))))
+    return driverTuple
+
+def importPycurl():
+    '''Imports pycurl downloader library on first use, returns pycurl module.'''
+    global pycurl, caInfo # pylint: disable=W0603
+    if not pycurl:
+        try:
+            import pycurl as module
+        except ImportError as ex:
+            raise ImportError("%s: %s\nThis software requires pycurl.\nPlease install pycurl v7.19.3.1 or later: https://pypi.python.org/pypi/pycurl" % (ex.__class__.__name__, ex))
+        try: # certifi CA certificates library, pycurl builds often come without CA certificates
+            import certifi
+            caInfo = certifi.where()
+        except ImportError:
+            pass
+        pycurl = module
+    return pycurl
+
+def importURLGrabber():
+    '''Imports urlgrabber downloader library on first use, returns URLGrabber class.'''
+    global URLGrabber, URLGrabError # pylint: disable=W0603
+    if not URLGrabber:
+        importPycurl() # required by urlgrabber
+        try:
+            import urlgrabber
+            from urlgrabber.grabber import URLGrabber as grabber, URLGrabError as exception
+            if tuple(int(v) for v in urlgrabber.__version__.split('.')) < (3, 10):
+                if tuple(int(v) for v in urlgrabber.__version__.split('.')) < (3, 9, 1):
+                    raise ImportError('urlgrabber version %s < 3.9.1' % urlgrabber.__version__)
+                else:
+                    print("\nWARNING: You're using urlgrabber 3.9.1 which contains a known error.\nPlease use urlgrabber 3.10 or later whenever possible,\notherwise (on Windows) patch the urlgrabber source:\nLocate the file C:\\Python27\\Lib\\site-packages\\urlgrabber\\grabber.py\nand in line 1161 replace\nself.curl_obj.setopt(pycurl.SSL_VERIFYHOST, opts.ssl_verify_host)\nwith\nself.curl_obj.setopt(pycurl.SSL_VERIFYHOST, 0)\nSee https://ask.fedoraproject.org/en/question/35874/yum-pycurl-error-43/ for details.\n")
+        except ImportError as ex:
+            raise ImportError("%s: %s\nThis software requires urlgrabber.\nPlease install urlgrabber v3.9.1 or later: https://pypi.python.org/pypi/urlgrabber" % (ex.__class__.__name__, ex))
+        (URLGrabber, URLGrabError) = (grabber, exception)
+    return URLGrabber
+
+def importRequests():
+    '''Imports Requests HTTP library on first use, returns requests module or None if it's not available.'''
+    global requests, requestsChecked # pylint: disable=W0603
+    if not requestsChecked:
+        requestsChecked = True
+        try:
+            import requests as module
+            if tuple(int(v) for v in module.__version__.split('.')) < (2, 3, 0):
+                raise ImportError('Requests version %s < 2.3.0' % module.__version__)
+            requests = module
+        except ImportError as ex:
+            print("%s: %s\nWARNING: Video size information will not be available.\nPlease install Requests v2.3.0 or later: https://pypi.python.org/pypi/requests\n" % (ex.__class__.__name__, ex))
+    return requests
+
+def importPsutil():
+    '''Imports psutil process library on first use, returns psutil module or None if it's not available.'''
+    global psutil, psutilChecked # pylint: disable=W0603
+    if not psutilChecked:
+        psutilChecked = True
+        try:
+            import psutil as module
+            psutil = module
+        except ImportError as ex:
+            print("%s: %s\nWARNING: Browser memory use will not be checked.\nPlease install psutil: https://pypi.python.org/pypi/psutil\n" % (ex.__class__.__name__, ex))
+    return psutil
+
+def getBrowserMemory(driver):
+    '''Returns the memory used by the WebDriver process and its browser subprocesses, or None if unknown.'''
+    process = getattr(getattr(driver, 'service', None), 'process', None) or getattr(getattr(driver, 'binary', None), 'process', None)
+    if not process or not importPsutil():
+        return None
+    try:
+        parent = psutil.Process(process.pid)
+        return sum(p.memory_info().rss for p in [parent] + parent.children(recursive = True))
+    except psutil.Error:
+        return None
 
 try: # Filesystem symbolic links configuration
     from os import link as hardlink, symlink # UNIX # pylint: disable=E0611, W0611
@@ -68,9 +167,56 @@ except ImportError:
         def symlink(source, linkName):
             if not dll.CreateSymbolicLinkW(linkName, source, 0):
                 raise OSError("code %d" % dll.GetLastError())
-    except Exception, ex:
+    except Exception as ex:
         hardlink = symlink = None
-        print "%s: %s\nWARNING: Filesystem links will not be available.\nPlease run on UNIX or Windows Vista or later.\n" % (ex.__class__.__name__, ex)
+        print("%s: %s\nWARNING: Filesystem links will not be available.\nPlease run on UNIX or Windows Vista or later.\n" % (ex.__class__.__name__, ex))
+
+try: # Copy-on-write file clones, Linux
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None
+FICLONE = 0x40049409 # _IOW(0x94, 9, int)
+
+def reflink(source, target):
+    '''Creates target as a copy-on-write clone of source, sharing its data blocks, on filesystems that support it.'''
+    if not ioctl:
+        raise OSError("Reflinks are not supported on this platform")
+    with open(source, 'rb') as s:
+        with open(target, 'wb') as t:
+            try:
+                ioctl(t.fileno(), FICLONE, s.fileno())
+            except Exception:
+                t.close()
+                remove(target)
+                raise
+
+def kernelCopy(source, target):
+    '''Copies source to target in the kernel with copy_file_range() or sendfile(), or through user space where neither is available.'''
+    import os
+    with open(source, 'rb') as s:
+        with open(target, 'wb') as t:
+            (size, offset) = (getsize(source), 0)
+            for name in ('copy_file_range', 'sendfile'): # Python 3.8+ and 3.3+, UNIX
+                function = getattr(os, name, None)
+                if not function:
+                    continue
+                try:
+                    while offset < size:
+                        if name == 'copy_file_range': # Advances both file positions
+                            copied = function(s.fileno(), t.fileno(), size - offset)
+                        else: # Advances the target file position only
+                            copied = function(t.fileno(), s.fileno(), offset, size - offset)
+                        if not copied:
+                            break
+                        offset += copied
+                    if offset >= size:
+                        return
+                except OSError: # Not supported between these files, falling back
+                    pass
+            s.seek(offset)
+            t.seek(offset)
+            for block in iter(lambda: s.read(1024 * 1024), b''):
+                t.write(block)
 
 isWindows = platform.lower().startswith('win')
 
@@ -78,14 +224,23 @@ TITLE = 'VimeoCrawler v1.8 (c) 2013-2015 Vasily Zakharov vmzakhar@gmail.com'
 
 OPTION_NAMES = ('directory', 'login', 'max-items', 'retries', 'set-language', 'preset', 'timeout', 'webdriver')
 FIELD_NAMES = ('targetDirectory', 'credentials', 'maxItems', 'retryCount', 'setLanguage', 'setPreset', 'timeout', 'driverName')
+LONG_OPTION_NAMES = ('workers', 'downloads', 'max-size', 'budget', 'prefer', 'reserve', 'downloader', 'write-buffer', 'fsync', 'benchmark', 'manifest', 'from-manifest', 'queue', 'log-json', 'batch', 'recycle-pages', 'recycle-memory', 'recycle-latency', 'cache-ttl', 'min-speed', 'min-speed-time', 'daemon', 'poll-interval', 'status-port', 'migrate', 'report') # Options with parameters that have no short form
+LONG_FIELD_NAMES = ('workerCount', 'downloadCount', 'maxVideoSize', 'sizeBudget', 'preferFormat', 'reserveSpace', 'downloaderName', 'writeBufferSize', 'syncPolicy', 'benchmark', 'manifestFileName', 'manifestSource', 'queueFileName', 'jsonLogFileName', 'batchFileName', 'recyclePages', 'recycleMemory', 'recycleLatency', 'cacheTTL', 'minSpeed', 'minSpeedTime', 'daemonFileName', 'pollInterval', 'statusPort', 'migrateLayout', 'reportFileName')
 SHORT_OPTIONS = ''.join(('%c:' % option[0]) for option in OPTION_NAMES) + 'hvnfzc'
-LONG_OPTIONS = tuple(('%s=' % option) for option in OPTION_NAMES) + ('help', 'verbose', 'no-download', 'no-folders', 'no-filesize', 'verify-content', 'hard-links', 'hd')
+LONG_OPTIONS = tuple(('%s=' % option) for option in OPTION_NAMES + LONG_OPTION_NAMES) + ('help', 'verbose', 'no-download', 'no-folders', 'no-filesize', 'verify-content', 'hard-links', 'hd', 'no-direct-links', 'no-index', 'revalidate', 'trace', 'refresh', 'sharded')
 
-USAGE_INFO = '''Usage: python VimeoCrawler.py [options] [start URL or video ID]
+USAGE_INFO = '''Usage: python VimeoCrawler.py [options] [start URLs or video IDs]
+       python VimeoCrawler.py [options] --from-manifest=file
+       python VimeoCrawler.py [options] --queue=file
+       python VimeoCrawler.py [options] --daemon=file
+       python VimeoCrawler.py [options] --benchmark=name
+       python VimeoCrawler.py [options] --migrate=layout
 
 The crawler checks the specified URL and processes the specified video,
 album, channel or the whole account, trying to locate the highest available
 quality file for each video.
+Several start URLs are crawled in one batch, with one browser and login,
+every video is processed once even if found from several of them.
 
 For every video found a file is downloaded to the target directory.
 For any channel or album encountered, a subfolder is created in the target
@@ -96,17 +251,110 @@ In default configuration, the program requires Mozilla Firefox.
 Options:
 -h --help - Displays this help message.
 -v --verbose - Provide verbose logging.
+   --log-json - Also write the log to the specified JSON lines file,
+                 every line tagged with the video ID, worker and phase.
 -n --no-download - Crawl only, do not download anything.
+   --batch - Crawl start URLs or video IDs listed in the specified file,
+                 one per line, in addition to the ones on the command line.
+   --manifest - Write the crawl results (videos, chosen file versions, links,
+                 sizes and folders) to the specified JSON lines file.
+   --report - After processing, compare the crawled videos and folders with
+                 the target directory and write the differences to the
+                 specified JSON lines file: orphaned (local files of videos
+                 not found, meaningful when the whole account is crawled),
+                 missing (videos not on disk, with the reason) and
+                 mismatched (file names, sizes or folder links differing,
+                 or files not complete according to the library index).
+                 Can't be used with --queue or --daemon.
+   --from-manifest - Download and create folders from the specified manifest
+                 file, without crawling and without starting a browser.
+   --queue - Put the crawled or manifest videos to the specified shared
+                 SQLite queue file, then download videos claimed from it.
+                 Without start URL, login or manifest, only downloads
+                 from the queue. Run several processes or hosts against
+                 the same queue and target directory to share the work.
+                 Every process writes its own log files, named with
+                 its host name and process ID.
+   --daemon - Keep running and poll the start URLs or video IDs listed
+                 in the specified file, one per line, optionally followed
+                 by the poll interval of that line, like 30m or 6h.
+                 Every poll loads the listings from Vimeo and downloads
+                 the videos not complete in the target directory yet
+                 (and the changed ones, with --revalidate). The browser,
+                 login and library index are kept between polls.
+                 Stop the daemon with Ctrl-C.
+   --poll-interval - Default daemon poll interval, like 900, 30m or 6h,
+                 default is 1h. Intervals are varied by 10% every poll.
+   --status-port - Serve the daemon status as JSON at
+                 http://127.0.0.1:port/ (state, polls, errors and
+                 the last and next poll of every start URL).
 -f --no-folders - Do not create subfolders with links for channels and albums.
 -z --no-filesize - Do not get file sizes for videos (speeds up crawling a bit).
    --hard-links - Use hard links instead of symbolic links in subfolders.
+                 Where links can't be created, files are cloned with
+                 reflinks, or copied in the kernel as the last resort.
+   --sharded - Store video files in 256 subdirectories of the
+                 VimeoCrawler.files subdirectory, chosen by the hash of
+                 the video ID, instead of the target directory itself,
+                 for very large libraries. Needed only to start a new
+                 library, the layout of existing ones is detected.
+   --no-direct-links - Always open the video page download dialog to locate
+                 download links, instead of requesting the download
+                 configuration data directly.
+   --no-index - Locate download links even for the videos whose files
+                 are complete in the target directory according to
+                 the library index, instead of skipping them.
+   --revalidate - Locate download links for the videos complete in the target
+                 directory and ask the server with conditional requests
+                 whether their files have changed since they were downloaded.
+                 Changed files are downloaded again, the old ones are kept
+                 until the new ones are complete.
+   --refresh - Load all listing pages and folder titles from Vimeo, instead
+                 of using the ones cached by recent runs, see --cache-ttl.
+   --trace - Time every browser command, log it with its selector and
+                 whether the element was found, and report the commands
+                 per video, the time lost to missing elements and
+                 the slowest selectors at the end of the run.
 
 -l --login - Vimeo login credentials, formatted as email:password.
 -d --directory - Target directory to save all the output files to,
                  default is the current directory.
+   --reserve - Free space to leave in the target directory, like 500MB,
+                 default is 1GB. Downloads that don't fit are deferred.
+   --cache-ttl - Seconds to reuse listing page items and folder titles
+                 cached in the target directory by previous runs for,
+                 default is 3600, 0 disables the cache.
 
 -w --webdriver - Selenium WebDriver to use for crawling, default is Firefox.
+   --workers - Maximum number of browser instances to load listing pages
+                 with in parallel, default is 1 (pages are loaded one by one).
+   --recycle-pages - Restart the main browser after loading the specified
+                 number of pages, default is 1000, 0 means never.
+   --recycle-memory - Restart the main browser when it uses more memory than
+                 the specified size, like 2GB, requires psutil.
+   --recycle-latency - Restart the main browser when page loads get slower
+                 than the first ones after its start by the specified factor,
+                 default is 3, 0 means never.
+                 Crashed browsers are restarted too, session cookies are
+                 carried over to the new browser.
+   --downloads - Maximum number of videos to download in parallel, default
+                 is 1. Parallel page loads and downloads start one at a time
+                 and are added while throughput rises, they are reduced
+                 when Vimeo throttles requests (HTTP 429/503) or responses
+                 slow down.
 -t --timeout - Download attempt timeout, default is 60 seconds.
+   --min-speed - Minimum download speed per second, like 50KB, default is
+                 10KB, 0 disables the check. Downloads slower than that for
+                 --min-speed-time seconds (default is 60) are restarted
+                 on a fresh connection, resuming from where they stopped,
+                 and after 2 restarts are retried after the other videos.
+   --downloader - Library to download files with: urlgrabber, pycurl
+                 or requests, default is urlgrabber (pycurl on Python 3).
+   --write-buffer - Size of the buffer pycurl and requests downloaders write
+                 files through, preallocating them, default is 8MB.
+                 Selects pycurl if --downloader is not specified.
+   --fsync - When to flush downloaded data to disk with pycurl and requests:
+                 none (default), end (of the file) or buffer (every buffer).
 -r --retries - Number of page download retry attempts, default is 3.
 -m --max-items - Maximum number of items (videos or folders) to retrieve
                  from one page (usable for testing), default is none.
@@ -116,19 +364,50 @@ Options:
 -c --verify-content - Verify downloaded files to be valid video files,
                  requires ffmpeg to be available in the path.
 
+   --max-size - Download the best file version not larger than the specified
+                 size, like 500MB or 2G, skip videos that have none.
+   --budget - Total size of file versions to choose during the run,
+                 smaller versions are chosen when the budget runs low.
+   --prefer - Prefer file versions with the specified container or codec,
+                 like MP4 or H264.
+                 With -n, these options report the space that would be saved.
+
 If start URL is not specified, the login credentials have to be specified.
 In that case, the whole account for those credentials would be crawled.
+
+--migrate moves the video files in the target directory to the specified
+layout, flat or sharded, and points the symbolic links in the subfolders
+to their new places, instead of crawling. An interrupted migration is
+completed by running it again.
+
+--benchmark measures performance in the target directory instead of crawling:
+write - Compares plain and --write-buffer file writing throughput.
+download - Compares throughput and CPU time per MB of the downloaders,
+           downloading from a local HTTP server.
+materialize - Compares the speed of the ways to put a file into a folder:
+           links, reflink and kernel copy.
 '''
 
 def usage(error = None):
     '''Prints usage information (preceded by optional error message) and exits with code 2.'''
-    print "%s\n" % TITLE
-    print USAGE_INFO
+    print("%s\n" % TITLE)
+    print(USAGE_INFO)
     if error:
-        print error
+        print(error)
     exit(2 if error else 0)
 
 LOG_FILE_NAME = 'VimeoCrawler.log'
+WORKER_LOG_FILE_NAME = '%s.%s.%d%s' # <name>.<host>.<pid><extension>, with --queue every process rotates its own log files
+LOG_MAX_SIZE = 10 * 1024 * 1024 # Log files are appended to and rotated when they grow larger
+LOG_BACKUP_COUNT = 5
+LIBRARY_INDEX_FILE_NAME = 'VimeoCrawler.index'
+OLD_FILE_SUFFIX = '.old' # Changed video file being downloaded again
+SELECTOR_STATS_FILE_NAME = 'VimeoCrawler.selectors'
+LISTING_CACHE_FILE_NAME = 'VimeoCrawler.listings'
+SHARD_DIRECTORY_NAME = 'VimeoCrawler.files' # Video files of the sharded layout, in SHARD_DIRECTORY_NAME/<shard>/<file name>
+SHARD_DIGITS = 2 # Hex digits of the video ID hash naming its shard, 256 shards keep 200k video libraries under 1000 files per directory
+LAYOUTS = ('flat', 'sharded')
+FOLDER_TITLE_SELECTORS = ('#page_header h1 a', '#page_header h1', '#group_header h1 a@title', '#group_header h1 a') # css[@attribute], text if no attribute
 
 VIMEO = 'vimeo.com'
 VIMEO_URL = 'https://%s/%%s' % VIMEO
@@ -139,6 +418,47 @@ VIDEOS_LINKS = ('videos') # http://vimeo.com/account/videos URLs
 FOLDERS_LINKS = ('album', 'groups', 'channels') # http://vimeo.com/folder/*
 FOLDER_NAMES = {'albums': 'album', 'groups': 'group', 'channels': 'channel'} # Mapping to singular for printing
 FILE_PREFERENCES = ('Original', 'On2 HD', 'On2 SD', 'HD', 'SD', 'Mobile', 'file') # Vimeo file versions parts
+VIDEO_FILE_PATTERN = r'(?:^| )(\d+)\.[^. ]+$' # <title> <vID>.<extension>, or <vID>.<extension> if the title is unknown
+PAGE_NUMBER_PATTERN = r'/page:(\d+)' # http://vimeo.com/account/videos/page:2/sort:date
+DOWNLOAD_CONFIG_URL = VIMEO_URL % '%d?action=load_download_config' # Data behind the video page download dialog
+OEMBED_URL = VIMEO_URL % 'api/oembed.json?url=%s'
+
+SYNC_POLICIES = ('none', 'end', 'buffer') # fsync never, at the end of the file or after every buffer written
+DEFAULT_WRITE_BUFFER = '8MB'
+WRITE_ALIGNMENT = 64 * 1024 # Buffered data is written in blocks that end at multiples of this
+CURL_CHUNK_SIZE = 16 * 1024 # CURL_MAX_WRITE_SIZE, size of the data pieces passed to WRITEFUNCTION
+CURLE_OPERATION_TIMEDOUT = 28 # Also reported when the transfer is slower than LOW_SPEED_LIMIT for LOW_SPEED_TIME
+DEGRADED_RESTARTS = 2 # Restarts of a slow download before it's retried after the other videos
+LINK_MAX_AGE = 3600 # seconds, older download links may have expired and are located again before downloading, if a browser is available
+VALIDATOR_HEADERS = (('etag', 'etag'), ('lastModified', 'last-modified')) # Library index fields and response headers that identify a file version
+REVALIDATION_RESULTS = ('unchanged', 'changed', 'unknown')
+RECONCILIATION_RESULTS = ('orphaned', 'missing', 'mismatched') # Local files not found remotely, remote videos not on disk, differing names, sizes, folder links or incomplete files
+THROTTLE_STATUSES = (429, 503) # Too Many Requests, Service Unavailable
+POLL_JITTER = 0.1 # Daemon poll intervals are varied by this fraction, so the targets drift apart instead of being polled together
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+DOWNLOADERS = ('urlgrabber', 'pycurl', 'requests')
+DEFAULT_DOWNLOADER = 'pycurl' if isPython3 else 'urlgrabber' # urlgrabber 3.x is Python 2 only
+
+BENCHMARKS = ('write', 'download', 'materialize')
+BENCHMARK_FILE_NAME = 'VimeoCrawler.benchmark'
+BENCHMARK_SIZE = 256 * 1024 * 1024
+BENCHMARK_SERVER = '''
+try:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+from sys import stdout
+class Handler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+server = HTTPServer(('127.0.0.1', 0), Handler)
+stdout.write('%d\\n' % server.server_address[1])
+stdout.flush()
+server.serve_forever()
+''' # Serves the current directory in a separate process, so that its CPU time is not counted, prints the port number
 
 UNITS = ('bytes', 'KB', 'MB', 'GB', 'TB', 'PB', 'EB', 'ZB', 'YB')
 def readableSize(size):
@@ -152,17 +472,103 @@ def readableSize(size):
         fSize = '%.0f' % size
     return '%s %s' % (fSize, unit) # pylint: disable=W0631
 
+def parseSize(size):
+    '''Parses size like 700, 500MB, 1.5G or 2 GB into the number of bytes.'''
+    m = match(r'^\s*(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s*$', size)
+    if not m:
+        raise ValueError("Invalid size: %s" % size)
+    unit = m.group(2).upper().rstrip('B') or 'BYTES'
+    units = tuple(u.upper().rstrip('B') for u in UNITS)
+    if unit not in units:
+        raise ValueError("Invalid size unit: %s" % m.group(2))
+    return int(float(m.group(1)) * 1024 ** units.index(unit))
+
+def parseDuration(duration):
+    '''Parses duration like 900, 15m, 6h or 1d into the number of seconds.'''
+    m = match(r'^\s*(\d+(?:\.\d+)?)\s*([A-Za-z]?)\s*$', str(duration))
+    if not m or m.group(2).lower() not in DURATION_UNITS:
+        raise ValueError("Invalid duration: %s" % duration)
+    return int(float(m.group(1)) * DURATION_UNITS[m.group(2).lower()])
+
+def formatTime(t):
+    return strftime(TIME_FORMAT, localtime(t)) if t else None
+
+FALLOC_FL_KEEP_SIZE = 1
+libc = None
+def preallocate(fd, offset, length):
+    '''Reserves disk space for the file without changing its size, so partial files still get resumed correctly.
+
+    posix_fallocate() is not used, as it extends the file. Returns True on success.'''
+    global libc # pylint: disable=W0603
+    try:
+        from ctypes import CDLL, c_int, c_longlong
+        from ctypes.util import find_library
+        if libc is None:
+            libc = CDLL(find_library('c'), use_errno = True)
+        return libc.fallocate(c_int(fd), c_int(FALLOC_FL_KEEP_SIZE), c_longlong(offset), c_longlong(length)) == 0
+    except Exception: # Not Linux
+        libc = False
+        return False
+
+class FileWriter(object):
+    '''Writes a file through a large buffer in aligned blocks, with the disk space preallocated,
+    and computes the MD5 checksum of the file as it's written from the start.'''
+    def __init__(self, fileName, size = None, offset = 0, bufferSize = parseSize(DEFAULT_WRITE_BUFFER), syncPolicy = 'none'):
+        self.file = FileIO(fileName, 'r+' if offset else 'w')
+        self.file.truncate(offset)
+        self.checksum = None if offset else md5() # The existing part is not read when resuming
+        self.file.seek(offset)
+        self.offset = offset
+        self.bufferSize = max(bufferSize, WRITE_ALIGNMENT)
+        self.syncPolicy = syncPolicy
+        self.chunks = []
+        self.buffered = 0
+        if size and size > offset:
+            preallocate(self.file.fileno(), offset, size - offset)
+
+    def write(self, data):
+        if self.checksum:
+            self.checksum.update(data)
+        self.chunks.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.bufferSize:
+            self.flush(True)
+
+    def flush(self, aligned = False):
+        data = b''.join(self.chunks)
+        end = len(data) - ((self.offset + len(data)) % WRITE_ALIGNMENT if aligned else 0)
+        view = memoryview(data)
+        written = 0
+        while written < end:
+            written += self.file.write(view[written:end])
+        self.offset += end
+        self.chunks = [data[end:]] if end < len(data) else []
+        self.buffered = len(data) - end
+        if self.syncPolicy == 'buffer':
+            fsync(self.file.fileno())
+
+    def close(self):
+        try:
+            self.flush()
+            if self.syncPolicy != 'none':
+                fsync(self.file.fileno())
+        finally:
+            self.file.close()
+
 INVALID_FILENAME_CHARS = '<>:"/\\|?*\'' # for file names, to be replaced with _
 def cleanupFileName(fileName):
     return ''.join('_' if c in INVALID_FILENAME_CHARS else c for c in fileName)
 
 CONSOLE_ENCODING = stdout.encoding or ('cp866' if isWindows else 'UTF-8')
-def encodeForConsole(s):
-    return s.encode(CONSOLE_ENCODING, 'replace')
+def encodeForConsole(s): # Python 3 console does the encoding by itself
+    return s if isPython3 else s.encode(CONSOLE_ENCODING, 'replace')
+
+def decodeFromConsole(s):
+    return s if isPython3 else s.decode(CONSOLE_ENCODING)
 
 FILE_SYSTEM_ENCODING = getfilesystemencoding()
 def encodeForFileSystem(s):
-    return s.encode(FILE_SYSTEM_ENCODING, 'replace')
+    return s if isPython3 else s.encode(FILE_SYSTEM_ENCODING, 'replace')
 
 def getFileSize(fileName):
     try:
@@ -170,6 +576,80 @@ def getFileSize(fileName):
     except:
         return None
 
+def getFreeSpace(directory):
+    '''Returns the number of bytes available to the user on the filesystem of the specified directory, or None if unknown.'''
+    try:
+        if isWindows:
+            from ctypes import byref, c_ulonglong, windll # pylint: disable=E0611
+            freeSpace = c_ulonglong(0)
+            if not windll.kernel32.GetDiskFreeSpaceExW(unicode(directory), byref(freeSpace), None, None):
+                return None
+            return freeSpace.value
+        from os import statvfs # pylint: disable=E0611
+        info = statvfs(directory)
+        return info.f_bavail * info.f_frsize
+    except Exception:
+        return None
+
+class LogContext(Filter):
+    '''Tags log records with the video ID and phase set by the thread that logs them, and the worker.'''
+    def __init__(self):
+        Filter.__init__(self)
+        self.state = local()
+        self.host = gethostname()
+
+    def set(self, vID = None, phase = None):
+        (self.state.vID, self.state.phase) = (vID, phase)
+
+    def filter(self, record):
+        record.vID = getattr(self.state, 'vID', None)
+        record.phase = getattr(self.state, 'phase', None)
+        record.worker = '%s:%d/%s' % (self.host, record.process, record.threadName)
+        return True
+
+logContext = LogContext()
+
+class JSONLogFormatter(Formatter):
+    '''Formats log records tagged by LogContext as JSON lines.'''
+    def format(self, record):
+        message = record.getMessage()
+        if record.exc_info:
+            message += '\n' + self.formatException(record.exc_info)
+        return dumps({ 'time': self.formatTime(record, '%Y-%m-%d %H:%M:%S'), 'level': record.levelname,
+                       'message': message if isinstance(message, unicode) else decodeFromConsole(message),
+                       'vID': getattr(record, 'vID', None), 'worker': getattr(record, 'worker', None), 'phase': getattr(record, 'phase', None) })
+
+class AsyncLogHandler(Handler):
+    '''Passes log records to the target handlers in a background thread, so that logging threads don't wait for formatting and disk writes.'''
+    def __init__(self, *handlers):
+        Handler.__init__(self)
+        self.handlers = handlers
+        self.records = Queue()
+        self.thread = Thread(target = self.dispatch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        self.records.put(record)
+
+    def dispatch(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def close(self):
+        '''Writes out the queued records, called by logging.shutdown() on exit.'''
+        if self.thread.is_alive():
+            self.records.put(None)
+            self.thread.join()
+        for handler in self.handlers:
+            handler.close()
+        Handler.close(self)
+
 class URL(object):
     FILE_NAME = 'source.url'
     def __init__(self, url):
@@ -216,8 +696,1139 @@ class URL(object):
     def __hash__(self):
         return hash(self.url)
 
-    def __cmp__(self, other):
-        return 1 if self.url > other.url else -1 if self.url < other.url else 0
+    def __eq__(self, other):
+        return self.url == other.url
+
+    def __ne__(self, other):
+        return self.url != other.url
+
+    def __lt__(self, other):
+        return self.url < other.url
+
+Rendition = namedtuple('Rendition', ('quality', 'extension', 'size', 'url', 'codec')) # One downloadable file version of a video
+
+def preferenceIndex(quality):
+    '''Returns the position of the specified file version in FILE_PREFERENCES, unknown versions go last.'''
+    for (index, preference) in enumerate(FILE_PREFERENCES):
+        if preference in quality:
+            return index
+    return len(FILE_PREFERENCES)
+
+def parseDownloadConfig(config):
+    '''Parses download configuration data into (title, renditions), renditions are ordered by FILE_PREFERENCES.'''
+    files = list(config.get('files') or ())
+    if config.get('source_file'):
+        files.insert(0, dict(config['source_file'], public_name = 'Original'))
+    renditions = []
+    for f in files:
+        url = f.get('download_url') or f.get('link')
+        if not url:
+            continue
+        extension = f.get('extension') or url.split('?')[0].split('.')[-1]
+        size = int(f['size']) if str(f.get('size') or '').isdigit() else None
+        renditions.append(Rendition(f.get('public_name') or f.get('quality') or 'file', extension, size, url, f.get('codec')))
+    renditions.sort(key = lambda rendition: preferenceIndex(rendition.quality))
+    return ((config.get('clip') or {}).get('title'), tuple(renditions))
+
+class LinkResolver(object):
+    '''Gets video title and download renditions from the download configuration data, without loading the video page.
+
+    fetch(url) must return the response body, it can be replaced to serve local fixture files.'''
+    def __init__(self, fetch, configURL = DOWNLOAD_CONFIG_URL, oembedURL = OEMBED_URL):
+        self.fetch = fetch
+        self.configURL = configURL
+        self.oembedURL = oembedURL
+
+    def resolve(self, vID):
+        (title, renditions) = parseDownloadConfig(loads(self.fetch(self.configURL % vID)))
+        if not renditions:
+            raise ValueError("No download links available")
+        if not title:
+            title = loads(self.fetch(self.oembedURL % quote(VIMEO_URL % vID, '')))['title']
+        return (title, renditions)
+
+class RenditionPolicy(object):
+    '''Chooses a video rendition according to size limits and format preferences, instead of always the best one.'''
+    def __init__(self, maxSize = None, budget = None, preferFormat = None):
+        self.maxSize = maxSize
+        self.budget = budget
+        self.preferFormat = preferFormat.lower() if preferFormat else None
+        self.needsSizes = bool(maxSize or budget)
+        self.choices = {} # vID => (default rendition, chosen rendition or None)
+
+    def isPreferred(self, rendition):
+        return self.preferFormat in (rendition.extension.lower(), (rendition.codec or '').lower())
+
+    def choose(self, vID, renditions):
+        '''Returns the rendition to download, or None if none fits, renditions must be ordered by FILE_PREFERENCES.'''
+        candidates = renditions
+        if self.preferFormat:
+            candidates = tuple(r for r in renditions if self.isPreferred(r)) + tuple(r for r in renditions if not self.isPreferred(r))
+        limits = ((self.maxSize,) if self.maxSize else ()) + ((self.budget - self.getSelectedSize(vID),) if self.budget else ())
+        if limits:
+            candidates = tuple(r for r in candidates if r.size is not None and r.size <= min(limits))
+        chosen = candidates[0] if candidates else None
+        self.choices[vID] = (renditions[0], chosen)
+        return chosen
+
+    def getSelectedSize(self, excludeVID = None):
+        return sum(chosen.size or 0 for (vID, (_default, chosen)) in self.choices.items() if chosen and vID != excludeVID)
+
+    def getDefaultSize(self):
+        return sum(default.size or 0 for (default, _chosen) in self.choices.values())
+
+    def getReport(self):
+        changed = sum(1 for (default, chosen) in self.choices.values() if chosen != default)
+        skipped = sum(1 for (_default, chosen) in self.choices.values() if not chosen)
+        (selected, default) = (self.getSelectedSize(), self.getDefaultSize())
+        return "Rendition policy: %d of %d videos changed (%d skipped), %s selected instead of %s, %s saved" \
+               % (changed, len(self.choices), skipped, readableSize(selected), readableSize(default), readableSize(max(0, default - selected)))
+
+def parseRetryAfter(value):
+    '''Returns the number of seconds to wait according to Retry-After header value, or None.'''
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    date = parsedate_tz(value)
+    return max(0, mktime_tz(date) - time()) if date else None
+
+class ConcurrencyController(object):
+    '''Limits the number of concurrent operations and adjusts the limit with AIMD.
+
+    After every window of as many operations as the limit, the limit grows by one if throughput has risen.
+    It's halved when requests get throttled or latency rises well above the best seen, Retry-After pauses new operations.
+
+    Latency is the time to the first response, throughput is the mean rate of the operations times the limit,
+    so neither depends on how much data each operation transfers.'''
+    LATENCY_FACTOR = 2 # Latency rise that means congestion
+    MAX_PAUSE = 300 # seconds, longer Retry-After values are cut
+
+    def __init__(self, name, maxLimit, logger):
+        self.name = name
+        self.maxLimit = maxLimit
+        self.logger = logger
+        self.limit = 1
+        self.active = 0
+        self.condition = Condition()
+        self.pausedUntil = 0
+        self.startTime = time()
+        self.adjustments = [] # (seconds since start, old limit, new limit, reason)
+        self.lastThroughput = None
+        self.bestLatency = None
+        self.resetWindow()
+
+    def resetWindow(self):
+        self.windowStart = time()
+        self.windowCount = 0
+        self.windowTimed = 0 # Operations with latency known
+        self.windowRate = 0
+        self.windowLatency = 0
+
+    def adjust(self, limit, reason):
+        self.adjustments.append((time() - self.startTime, self.limit, limit, reason))
+        self.logger.info("%s concurrency %d -> %d: %s", self.name, self.limit, limit, reason)
+        self.limit = limit
+        self.resetWindow()
+
+    def waitPause(self):
+        '''Waits until the pause requested with Retry-After is over.'''
+        pause = self.pausedUntil - time()
+        if pause > 0:
+            sleep(pause)
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                pause = self.pausedUntil - time()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.active >= self.limit:
+                    self.condition.wait()
+                else:
+                    break
+            self.active += 1
+
+    def release(self, latency, amount = 1, duration = None):
+        '''Ends an operation that got the first response in latency seconds and transferred amount of data in duration seconds,
+        latency is None if the operation made no request.'''
+        with self.condition:
+            self.active -= 1
+            self.windowCount += 1
+            if latency is not None:
+                self.windowTimed += 1
+                self.windowLatency += latency
+                self.windowRate += amount / max(duration or latency, 0.001)
+            if self.windowCount >= self.limit and not self.windowTimed:
+                self.resetWindow()
+            elif self.windowCount >= self.limit:
+                throughput = self.windowRate / self.windowTimed * self.limit
+                latency = float(self.windowLatency) / self.windowTimed
+                if self.bestLatency and latency > self.bestLatency * self.LATENCY_FACTOR and self.limit > 1:
+                    self.adjust(max(1, self.limit // 2), "latency rose to %.1fs from %.1fs" % (latency, self.bestLatency))
+                elif self.limit < self.maxLimit and (self.lastThroughput is None or throughput > self.lastThroughput):
+                    self.adjust(self.limit + 1, "throughput rising")
+                else:
+                    self.resetWindow()
+                self.lastThroughput = throughput
+                self.bestLatency = min(self.bestLatency or latency, latency)
+            self.condition.notify_all()
+
+    def throttle(self, reason, retryAfter = None):
+        '''Backs off after the server has throttled a request.'''
+        with self.condition:
+            if retryAfter:
+                retryAfter = min(retryAfter, self.MAX_PAUSE)
+                self.pausedUntil = max(self.pausedUntil, time() + retryAfter)
+                reason += ", Retry-After %d s" % retryAfter
+            self.adjust(max(1, self.limit // 2), reason)
+            self.lastThroughput = None
+
+    def getReport(self):
+        return '\n'.join(["%s concurrency: %d adjustments, limit %d..%d, final %d" % (self.name, len(self.adjustments),
+                           min(a[2] for a in self.adjustments), max(a[2] for a in self.adjustments), self.limit)]
+                        + ["%8.1fs %d -> %d: %s" % adjustment for adjustment in self.adjustments])
+
+def createSession(userAgent, cookies):
+    '''Creates a Requests session with the specified browser user agent and cookies.'''
+    session = requests.Session()
+    session.headers['user-agent'] = userAgent
+    for cookie in cookies:
+        session.cookies.set(str(cookie['name']), str(cookie['value']))
+    return session
+
+def sessionFetcher(session, timeout = None, controller = None, retries = 3):
+    '''Returns fetch(url) function for LinkResolver that uses the specified Requests session.
+
+    Throttled requests are reported to the controller and retried after its pause.'''
+    def fetch(url):
+        for attempt in count():
+            if controller:
+                controller.waitPause()
+            response = session.get(url, headers = { 'x-requested-with': 'XMLHttpRequest' }, timeout = timeout)
+            if controller and response.status_code in THROTTLE_STATUSES and attempt < retries:
+                controller.throttle("HTTP %d" % response.status_code, parseRetryAfter(response.headers.get('retry-after')))
+                continue
+            response.raise_for_status()
+            return response.text
+    return fetch
+
+class DownloadError(Exception):
+    '''Download failure reported by any of the downloader backends, with HTTP status and Retry-After value if known.'''
+    def __init__(self, message, status = None, retryAfter = None):
+        Exception.__init__(self, message)
+        self.status = status
+        self.retryAfter = retryAfter
+
+class StalledDownloadError(DownloadError):
+    '''Download stalled or slower than the minimum speed, worth restarting on a fresh connection.'''
+
+class InsufficientSpaceError(DownloadError):
+    '''The remaining part of the file doesn't fit in the free space above the reserve, found out before any data is written.'''
+    def __init__(self, message, need):
+        DownloadError.__init__(self, message)
+        self.need = need
+
+class ProgressIndicator(object):
+    '''Displays download progress on the console, raises StalledDownloadError if no data arrives for timeout seconds,
+    or the download is slower than minSpeed bytes per second for minSpeedTime seconds.'''
+    QUANTUM = 10 * 1024 * 1024 # 10 megabytes
+    ACTION = r'--\\||//' # update() often gets called in pairs, this smoothes things up
+
+    def __init__(self, timeout, quiet = False, minSpeed = 0, minSpeedTime = 0):
+        self.timeout = timeout
+        self.quiet = quiet # Progress of parallel downloads can't share the console line
+        self.minSpeed = minSpeed
+        self.minSpeedTime = minSpeedTime
+        self.stalled = None # Raised error, kept for the downloaders whose libraries swallow errors raised in the progress callbacks
+        self.startTime = None
+        self.action = len(self.ACTION) - 1
+
+    def progress(self, s, suffix = ''):
+        if self.quiet:
+            return
+        self.action = (self.action + 1) % len(self.ACTION)
+        stdout.write('\b%s%s' % (s, suffix + '\n' if suffix else self.ACTION[self.action]))
+        stdout.flush()
+
+    def start(self, *_args, **kwargs):
+        self.length = kwargs.get('length') or kwargs.get('size')
+        self.startTime = time()
+        self.started = False
+        self.totalRead = 0
+        self.lastData = time()
+        self.windowStart = self.windowRead = None # Speed measurement window
+        self.stalled = None
+        self.count = 0
+        self.action = len(self.ACTION) - 1
+        self.progress("Dowloading: ")
+
+    def update(self, totalRead, suffix = ''):
+        now = time()
+        if totalRead == 0:
+            self.started = True
+        elif totalRead <= self.totalRead:
+            if now > self.lastData + self.timeout:
+                self.stall("Download seems stalled")
+        else:
+            self.totalRead = totalRead
+            self.lastData = now
+        if self.minSpeed and not suffix:
+            if self.windowStart is None: # Resumed downloads start with the data already there
+                (self.windowStart, self.windowRead) = (now, totalRead)
+            elif now - self.windowStart >= self.minSpeedTime:
+                speed = (totalRead - self.windowRead) / (now - self.windowStart)
+                if speed < self.minSpeed:
+                    self.stall("Download is too slow: %s/s for %d seconds" % (readableSize(speed), now - self.windowStart))
+                (self.windowStart, self.windowRead) = (now, totalRead)
+        oldCount = self.count
+        self.count = int(totalRead // self.QUANTUM) + 1
+        self.progress(('=' if self.started else '+') * max(0, self.count - oldCount), suffix)
+        self.started = True
+
+    def stall(self, message):
+        self.stalled = StalledDownloadError(message)
+        raise self.stalled
+
+    def end(self, totalRead):
+        self.update(totalRead, 'OK')
+
+class Downloader(object):
+    '''Downloads a link to a file, resuming the partial file if the server allows it.
+
+    Subclasses implement the download with a particular library, see DOWNLOADERS.'''
+    NAME = None
+
+    def __init__(self, link, fileName, size, userAgent, cookies, timeout, progressIndicator, bufferSize = parseSize(DEFAULT_WRITE_BUFFER), syncPolicy = 'none', reserveSpace = 0):
+        self.link = link
+        self.fileName = fileName
+        self.size = size
+        self.userAgent = userAgent
+        self.cookies = cookies
+        self.timeout = timeout
+        self.progressIndicator = progressIndicator
+        self.bufferSize = bufferSize
+        self.syncPolicy = syncPolicy
+        self.reserveSpace = reserveSpace
+        self.offset = getFileSize(fileName) or 0
+        self.writer = None
+        self.headers = {} # Final response headers, lowercase names, if the backend provides them
+        self.remoteSize = None # Learned from the response headers, if the backend provides them
+        self.requestTime = None
+        self.latency = None # Seconds from the request to the response headers
+
+    @staticmethod
+    def load():
+        '''Imports the library the downloader uses, raises ImportError if it's not available.'''
+        raise NotImplementedError
+
+    def getRemoteSize(self, status):
+        '''Returns the full size of the remote file according to the response headers, or None.'''
+        total = self.headers.get('content-range', '').split('/')[-1].strip() # bytes start-end/total or bytes */total
+        if total.isdigit():
+            return int(total)
+        length = self.headers.get('content-length', '').strip()
+        return int(length) if status == 200 and length.isdigit() else None
+
+    def openWriter(self, status):
+        '''Checks the response status and the remote file size once the response headers are known, before any data is written,
+        and opens the file for writing through FileWriter.
+
+        Returns False if the local file is already complete, raises InsufficientSpaceError if the rest of it doesn't fit.'''
+        self.latency = time() - self.requestTime
+        self.remoteSize = self.getRemoteSize(status)
+        if self.remoteSize is not None:
+            if self.offset > self.remoteSize:
+                raise DownloadError("Local file is larger (%d) than remote file (%d)" % (self.offset, self.remoteSize))
+            self.size = self.size or self.remoteSize
+        if status == 416 and self.offset and self.remoteSize in (None, self.offset): # Range not satisfiable, the file is already complete
+            return False
+        if status == 200 and self.offset and self.remoteSize == self.offset: # Range ignored, but the file is already complete
+            return False
+        if status >= 400:
+            raise DownloadError("HTTP Error %d" % status, status, self.headers.get('retry-after'))
+        if self.reserveSpace and self.remoteSize is not None:
+            need = self.remoteSize - self.offset # A partial file is either resumed or overwritten
+            freeSpace = getFreeSpace(dirname(self.fileName) or '.')
+            if freeSpace is not None and freeSpace - need < self.reserveSpace:
+                raise InsufficientSpaceError("Not enough free space for %s more, %s free, %s reserved" % (readableSize(need), readableSize(freeSpace), readableSize(self.reserveSpace)), need)
+        if status != 206: # Server doesn't support resuming
+            self.offset = 0
+        self.writer = FileWriter(self.fileName, self.size, self.offset, self.bufferSize, self.syncPolicy)
+        return True
+
+    def getChecksum(self):
+        '''Returns the MD5 checksum of the file computed while writing it, or None if the file was not written from the start through FileWriter.'''
+        return self.writer.checksum.hexdigest() if self.writer and self.writer.checksum else None
+
+    def getValidators(self):
+        '''Returns the response headers that identify the downloaded file version, for conditional requests later.'''
+        return dict((field, self.headers[header]) for (field, header) in VALIDATOR_HEADERS if header in self.headers)
+
+    def perform(self):
+        raise NotImplementedError
+
+class GrabberDownload(Downloader):
+    '''Downloads with urlgrabber, which writes the file by itself, so the write buffer is not used.'''
+    NAME = 'urlgrabber'
+
+    @staticmethod
+    def load():
+        return importURLGrabber()
+
+    def perform(self):
+        grabber = self.load()(reget = 'simple', timeout = self.timeout, progress_obj = self.progressIndicator,
+            user_agent = self.userAgent, http_headers = tuple((str(cookie['name']), str(cookie['value'])) for cookie in self.cookies))
+        self.requestTime = time()
+        try:
+            grabber.urlgrab(self.link, filename = self.fileName)
+        except URLGrabError as e:
+            if self.progressIndicator.stalled: # Raised in the progress callback, reported by urlgrabber as an ordinary error
+                raise self.progressIndicator.stalled
+            raise DownloadError(e, getattr(e, 'code', None))
+        finally:
+            if self.progressIndicator.startTime: # Started by urlgrabber once the response has arrived
+                self.latency = self.progressIndicator.startTime - self.requestTime
+
+class CurlDownload(Downloader):
+    '''Downloads with pycurl through FileWriter.'''
+    NAME = 'pycurl'
+
+    def __init__(self, *args, **kwargs):
+        Downloader.__init__(self, *args, **kwargs)
+        self.status = 0
+        self.error = None
+        self.complete = False
+
+    @staticmethod
+    def load():
+        return importPycurl()
+
+    def header(self, line):
+        if line.startswith(b'HTTP/'): # Redirects produce several responses, the last one counts
+            self.status = int(line.split()[1])
+            self.headers = {}
+        elif b':' in line:
+            (name, value) = line.decode('latin-1').split(':', 1)
+            self.headers[name.strip().lower()] = value.strip()
+        elif not line.strip() and not 100 <= self.status < 200 and not 300 <= self.status < 400: # End of the final response headers
+            try:
+                self.complete = not self.openWriter(self.status)
+            except DownloadError as e:
+                self.error = e
+                return 0 # Aborts the transfer
+            if self.complete:
+                return 0
+
+    def write(self, data):
+        if not self.writer: # Final response headers not recognized
+            return 0
+        self.writer.write(data)
+
+    def progress(self, _downloadTotal, downloaded, _uploadTotal, _uploaded):
+        try:
+            self.progressIndicator.update(self.offset + int(downloaded))
+        except DownloadError as e:
+            self.error = e
+            return 1 # Aborts the transfer
+
+    def perform(self):
+        self.load()
+        curl = pycurl.Curl()
+        curl.setopt(pycurl.URL, self.link)
+        curl.setopt(pycurl.FOLLOWLOCATION, True)
+        curl.setopt(pycurl.USERAGENT, self.userAgent)
+        curl.setopt(pycurl.COOKIE, '; '.join('%s=%s' % (cookie['name'], cookie['value']) for cookie in self.cookies))
+        curl.setopt(pycurl.CONNECTTIMEOUT, self.timeout)
+        curl.setopt(pycurl.NOPROGRESS, False)
+        curl.setopt(pycurl.PROGRESSFUNCTION, self.progress)
+        curl.setopt(pycurl.HEADERFUNCTION, self.header)
+        curl.setopt(pycurl.WRITEFUNCTION, self.write)
+        if caInfo:
+            curl.setopt(pycurl.CAINFO, caInfo)
+        if self.offset:
+            curl.setopt(pycurl.RESUME_FROM_LARGE, self.offset)
+        if self.progressIndicator.minSpeed: # Also catches stalls that don't reach the progress callback
+            curl.setopt(pycurl.LOW_SPEED_LIMIT, int(self.progressIndicator.minSpeed))
+            curl.setopt(pycurl.LOW_SPEED_TIME, int(self.progressIndicator.minSpeedTime))
+        self.progressIndicator.start(size = self.size)
+        self.requestTime = time()
+        try:
+            curl.perform()
+        except pycurl.error as e:
+            if self.complete:
+                self.progressIndicator.end(self.offset)
+                return
+            raise self.error or (StalledDownloadError if e.args[0] == CURLE_OPERATION_TIMEDOUT else DownloadError)(e.args[-1])
+        finally:
+            curl.close()
+            if self.writer:
+                self.writer.close()
+        if self.status >= 400:
+            raise DownloadError("HTTP Error %d" % self.status, self.status, self.headers.get('retry-after'))
+        self.progressIndicator.end(self.writer.offset if self.writer else self.offset)
+
+class RequestsDownload(Downloader):
+    '''Downloads with Requests through FileWriter.'''
+    NAME = 'requests'
+
+    @staticmethod
+    def load():
+        if not importRequests():
+            raise ImportError("Requests is not available")
+        return requests
+
+    def perform(self):
+        self.load()
+        headers = { 'user-agent': self.userAgent }
+        if self.offset:
+            headers['range'] = 'bytes=%d-' % self.offset
+        self.progressIndicator.start(size = self.size)
+        self.requestTime = time()
+        try:
+            response = requests.get(self.link, stream = True, headers = headers, timeout = self.timeout or None,
+                                    cookies = dict((str(cookie['name']), str(cookie['value'])) for cookie in self.cookies))
+            try:
+                self.headers = dict((name.lower(), value) for (name, value) in response.headers.items())
+                if not self.openWriter(response.status_code):
+                    self.progressIndicator.end(self.offset)
+                    return
+                try:
+                    for data in response.iter_content(CURL_CHUNK_SIZE):
+                        self.writer.write(data)
+                        self.progressIndicator.update(self.writer.offset + self.writer.buffered)
+                finally:
+                    self.writer.close()
+            finally:
+                response.close()
+        except requests.RequestException as e:
+            raise (StalledDownloadError if isinstance(e, getattr(requests, 'Timeout', ())) else DownloadError)(e)
+        self.progressIndicator.end(self.writer.offset)
+
+DOWNLOADER_CLASSES = dict((downloader.NAME, downloader) for downloader in (GrabberDownload, CurlDownload, RequestsDownload))
+
+def getShard(vID):
+    return md5(str(vID).encode('ascii')).hexdigest()[:SHARD_DIGITS]
+
+def getStoragePath(fileName, sharded):
+    '''Returns the path of the video file relative to the target directory: the file name itself, or its shard path.'''
+    if not sharded:
+        return fileName
+    return join(SHARD_DIRECTORY_NAME, getShard(int(search(VIDEO_FILE_PATTERN, fileName).group(1))), fileName)
+
+def isSharded(directory):
+    return isdir(join(directory, SHARD_DIRECTORY_NAME))
+
+def scanLibrary(directory, sharded = False):
+    '''Returns {vID: [file names]} of the video files in the directory or its shards, found with one scan of each directory.'''
+    files = {}
+    if sharded:
+        shardRoot = join(unicode(directory), SHARD_DIRECTORY_NAME)
+        directories = [join(shardRoot, shard) for shard in listdir(shardRoot)] if isdir(shardRoot) else []
+    else:
+        directories = [unicode(directory)]
+    for directory in directories:
+        for fileName in listdir(directory):
+            m = search(VIDEO_FILE_PATTERN, fileName)
+            if m and not isdir(join(directory, fileName)): # Folder directories may be named like videos, links to missing files count
+                files.setdefault(int(m.group(1)), []).append(fileName)
+    return files
+
+def readJSONLines(fileName):
+    '''Returns (records, line count) of the JSON lines sidecar file, skipping the lines that can't be parsed, or ([], 0) if there's no file.'''
+    records = []
+    lineCount = 0
+    if isfile(fileName):
+        with open(fileName) as f:
+            for line in f:
+                lineCount += 1
+                try:
+                    records.append(loads(line))
+                except ValueError: # Empty line, or the last line cut short by a crash
+                    continue
+    return (records, lineCount)
+
+class LibraryIndex(object):
+    '''Video files complete in the target directory, according to one directory scan
+    and a sidecar file with the sizes and checksums recorded after downloading, checksums are None where unknown.
+
+    Records are appended to the sidecar, so several queue workers can share it, the last record of a video counts.'''
+    def __init__(self, targetDirectory, sharded):
+        self.targetDirectory = targetDirectory
+        self.sharded = sharded
+        self.fileName = join(targetDirectory, LIBRARY_INDEX_FILE_NAME)
+        self.files = scanLibrary(targetDirectory, sharded)
+        self.records = dict((record['vID'], record) for record in readJSONLines(self.fileName)[0])
+
+    def getComplete(self, vID):
+        '''Returns the record of the video if its file is on disk with the recorded size and modification time, or None.'''
+        record = self.records.get(vID)
+        if not record or record['fileName'] not in self.files.get(vID, ()):
+            return None
+        fullName = encodeForFileSystem(join(self.targetDirectory, getStoragePath(record['fileName'], self.sharded)))
+        try:
+            info = stat(fullName)
+        except OSError:
+            return None
+        return record if info.st_size == record['size'] and int(info.st_mtime) == record['mtime'] else None
+
+    def add(self, job):
+        '''Records the downloaded file of the job.'''
+        record = { 'vID': job.vID, 'fileName': job.fileName, 'title': decodeFromConsole(job.title),
+                   'size': getsize(job.targetFileName), 'mtime': int(getmtime(job.targetFileName)), 'checksum': job.checksum }
+        record.update(job.validators)
+        with open(self.fileName, 'a') as f:
+            f.write(dumps(record) + '\n')
+        self.records[job.vID] = record
+        if job.fileName not in self.files.setdefault(job.vID, []):
+            self.files[job.vID].append(job.fileName)
+        return record
+
+class SelectorRegistry(object):
+    '''Scores of alternative selectors by page type, so that the one matching most often lately is tried first.
+
+    Scores are kept in a sidecar file in the target directory between runs.'''
+    DECAY = 0.9 # Score multiplier on every match on the page type, lets the order follow site changes
+
+    def __init__(self, targetDirectory):
+        self.fileName = join(targetDirectory, SELECTOR_STATS_FILE_NAME)
+        self.scores = {} # { pageType: { selector: score } }
+        self.changed = False
+        if isfile(self.fileName):
+            try:
+                with open(self.fileName) as f:
+                    self.scores = loads(f.read())
+            except ValueError: # Damaged file, starting over
+                pass
+
+    def order(self, pageType, selectors):
+        '''Returns the selectors, best scoring first, equal scores in the original order.'''
+        scores = self.scores.get(pageType, {})
+        return sorted(selectors, key = lambda selector: -scores.get(selector, 0))
+
+    def hit(self, pageType, selector):
+        scores = self.scores.setdefault(pageType, {})
+        for s in scores:
+            scores[s] *= self.DECAY
+        scores[selector] = scores.get(selector, 0) + 1
+        self.changed = True
+
+    def save(self):
+        if self.changed:
+            with open(self.fileName, 'w') as f:
+                f.write(dumps(self.scores, sort_keys = True))
+            self.changed = False
+
+class ListingCache(object):
+    '''Items and titles of listing pages and folders, keyed by URL, reused by runs within the TTL.
+
+    Records are appended to a sidecar file in the target directory as soon as each listing is loaded,
+    so a run after a crash reuses the listings loaded before it. Expired records are dropped when the file is read.'''
+    def __init__(self, targetDirectory, ttl):
+        self.fileName = join(targetDirectory, LISTING_CACHE_FILE_NAME)
+        self.ttl = ttl
+        (records, lineCount) = readJSONLines(self.fileName)
+        self.records = dict((record['url'], record) for record in records if record['time'] + ttl > time())
+        if lineCount > len(self.records): # Compacting
+            with open(self.fileName, 'w') as f:
+                f.write(''.join(dumps(record) + '\n' for record in self.records.values()))
+
+    def get(self, url):
+        record = self.records.get(URL(url).url)
+        return record if record and record['time'] + self.ttl > time() else None
+
+    def put(self, url, title, items):
+        record = { 'url': URL(url).url, 'time': int(time()), 'title': title, 'items': [str(item) for item in items] }
+        with open(self.fileName, 'a') as f:
+            f.write(dumps(record) + '\n')
+        self.records[record['url']] = record
+
+class VideoJob(object):
+    '''Everything known about a video between locating its download link and downloading it.'''
+    RECORD_FIELDS = ('vID', 'title', 'fileName', 'quality', 'extension', 'link', 'linkSize', 'userAgent') # Stored in the manifest
+
+    def __init__(self, vID, number):
+        self.vID = vID
+        self.number = number
+        self.title = ''
+        self.quality = None
+        self.extension = None
+        self.fileName = None
+        self.targetFileName = None
+        self.link = None
+        self.linkSize = None
+        self.userAgent = None
+        self.cookies = ()
+        self.policySkip = False
+        self.deferred = False
+        self.downloaded = False # Complete on disk according to the library index
+        self.modified = False # Complete on disk, but changed on the server since
+        self.validators = {} # Response headers identifying the downloaded file version
+        self.checksum = None # Computed while downloading the file, if the downloader could
+        self.stalls = 0 # Downloads that were too slow or stalled
+        self.latency = None # Seconds to the download response, None if no download was requested
+        self.transferTime = 0 # Seconds spent downloading
+        self.requeued = False
+        self.failed = False # A download failed, counted as an error if no retry succeeds
+        self.linkTime = None # When the link was located in this run
+
+    def getRecord(self, folders):
+        record = dict((field, getattr(self, field)) for field in self.RECORD_FIELDS)
+        record['title'] = decodeFromConsole(self.title)
+        record['folders'] = folders
+        return record
+
+    @classmethod
+    def fromRecord(cls, record, number):
+        job = cls(record['vID'], number)
+        for field in cls.RECORD_FIELDS[1:]:
+            setattr(job, field, record.get(field))
+        job.title = encodeForConsole(job.title or '')
+        job.link = str(job.link) if job.link else None
+        job.userAgent = str(job.userAgent) if job.userAgent else None
+        return job
+
+class PollTarget(object):
+    '''Start URL polled by the daemon on its own schedule.'''
+    def __init__(self, url, interval):
+        self.url = url
+        self.interval = interval
+        self.nextPoll = time() # Every target is polled at the start
+        self.lastPoll = None
+        self.polls = 0
+        self.videos = 0
+        self.errors = 0
+
+    def schedule(self, videos, errors):
+        self.lastPoll = time()
+        self.polls += 1
+        (self.videos, self.errors) = (videos, errors)
+        self.nextPoll = self.lastPoll + self.interval * uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+    def getStatus(self):
+        return {'url': '%s' % self.url, 'interval': self.interval, 'polls': self.polls, 'videos': self.videos, 'errors': self.errors,
+                'lastPoll': formatTime(self.lastPoll), 'nextPoll': formatTime(self.nextPoll)}
+
+def readPollTargets(fileName, defaultInterval):
+    '''Reads the daemon file: a start URL or video ID per line, optionally followed by its poll interval, like 30m or 6h.'''
+    targets = []
+    with open(fileName) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) > 2:
+                raise ValueError("Invalid line in daemon file %s: %s" % (fileName, line.strip()))
+            url = URL(fields[0])
+            if url.url not in (target.url.url for target in targets):
+                targets.append(PollTarget(url, parseDuration(fields[1]) if len(fields) > 1 else defaultInterval))
+    if not targets:
+        raise ValueError("No start URLs in daemon file %s" % fileName)
+    return targets
+
+def startStatusServer(port, getStatus):
+    '''Serves the dictionary returned by getStatus() as JSON at http://127.0.0.1:port/ from a background thread.'''
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/status'):
+                self.send_error(404)
+                return
+            body = dumps(getStatus(), indent = 2, sort_keys = True).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_args): # Status requests are not logged
+            pass
+
+    server = HTTPServer(('127.0.0.1', port), StatusHandler)
+    thread = Thread(target = server.serve_forever, name = 'StatusServer')
+    thread.daemon = True
+    thread.start()
+    return server
+
+class WorkQueue(object):
+    '''Video jobs shared in an SQLite database, claimed by worker processes with leases they have to renew.
+
+    Jobs whose leases have expired, as their workers have died, get claimed again.'''
+    LEASE_TIME = 300 # seconds
+    STATES = ('pending', 'leased', 'done', 'failed')
+
+    def __init__(self, fileName):
+        self.connection = connect(fileName, timeout = 60, isolation_level = None, check_same_thread = False)
+        self.lock = Lock() # Leases are renewed from another thread
+        self.connection.execute('CREATE TABLE IF NOT EXISTS jobs (vID INTEGER PRIMARY KEY, record TEXT NOT NULL, state TEXT NOT NULL, owner TEXT, leaseUntil REAL, attempts INTEGER NOT NULL DEFAULT 0)')
+
+    def execute(self, *args):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                for (sql, parameters) in args:
+                    cursor.execute(sql, parameters)
+                self.connection.commit()
+                return cursor
+            except:
+                self.connection.rollback()
+                raise
+
+    def add(self, records):
+        '''Adds or updates jobs, jobs that are already done are kept done, jobs leased to live workers are kept leased.'''
+        (statements, now) = ([], time())
+        for record in records:
+            statements.append(("UPDATE jobs SET record = ?, state = CASE WHEN state = 'leased' AND leaseUntil >= ? THEN state ELSE 'pending' END, "
+                               "attempts = CASE WHEN state = 'leased' AND leaseUntil >= ? THEN attempts ELSE 0 END WHERE vID = ? AND state != 'done'",
+                               (dumps(record), now, now, record['vID'])))
+            statements.append(("INSERT OR IGNORE INTO jobs (vID, record, state) VALUES (?, ?, 'pending')", (record['vID'], dumps(record))))
+        self.execute(*statements)
+
+    def claim(self, owner):
+        '''Returns the record of a job leased to the owner, or None if no jobs are available.'''
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                now = time()
+                row = cursor.execute("SELECT vID, record FROM jobs WHERE state = 'pending' OR state = 'leased' AND leaseUntil < ? ORDER BY attempts, vID DESC LIMIT 1", (now,)).fetchone()
+                if row:
+                    cursor.execute("UPDATE jobs SET state = 'leased', owner = ?, leaseUntil = ?, attempts = attempts + 1 WHERE vID = ?", (owner, now + self.LEASE_TIME, row[0]))
+                self.connection.commit()
+            except:
+                self.connection.rollback()
+                raise
+        return loads(row[1]) if row else None
+
+    def renew(self, vID, owner):
+        '''Extends the lease, returns False if the lease has been lost to another worker.'''
+        return self.execute(("UPDATE jobs SET leaseUntil = ? WHERE vID = ? AND owner = ? AND state = 'leased'", (time() + self.LEASE_TIME, vID, owner))).rowcount == 1
+
+    def finish(self, vID, owner, success, maxAttempts):
+        '''Marks the job done, or returns it to the queue, or marks it failed after maxAttempts.'''
+        self.execute(("UPDATE jobs SET state = CASE WHEN ? THEN 'done' WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, owner = NULL, leaseUntil = NULL WHERE vID = ? AND owner = ?",
+                      (bool(success), maxAttempts, vID, owner)))
+
+    def getCounts(self):
+        with self.lock:
+            counts = dict(self.connection.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return tuple((state, counts.get(state, 0)) for state in self.STATES)
+
+    def getVIDs(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT vID FROM jobs ORDER BY vID DESC')]
+
+class LeaseKeeper(Thread):
+    '''Renews a work queue lease periodically while the job is being processed.'''
+    def __init__(self, queue, vID, owner):
+        Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.vID = vID
+        self.owner = owner
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(self.queue.LEASE_TIME / 3):
+            if not self.queue.renew(self.vID, self.owner):
+                getLogger('vimeo').warning("Lease for video %d is lost", self.vID)
+                break
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+class LinkReconciler(object):
+    '''Brings folder links in line with the desired folder contents, touching only the links that have to change.
+
+    Where links can't be created, files are materialized with the next method of MATERIALIZERS that works.'''
+    ACTIONS = ('created', 'retargeted', 'removed', 'unchanged', 'missing', 'failed') # missing: the file is not on disk, and can't be linked but symbolically
+    MATERIALIZERS = ('symlink', 'hardlink', 'reflink', 'copy')
+    UNSUPPORTED_ERRORS = tuple(getattr(errno, name) for name in ('EPERM', 'EXDEV', 'EOPNOTSUPP', 'ENOTSUP', 'ENOSYS', 'EINVAL') if hasattr(errno, name))
+
+    def __init__(self, targetDirectory, useHardLinks, logger, sharded = False):
+        self.targetDirectory = targetDirectory
+        self.useHardLinks = useHardLinks
+        self.sharded = sharded
+        self.logger = logger
+        self.counts = dict.fromkeys(self.ACTIONS, 0)
+        self.methods = dict.fromkeys(self.MATERIALIZERS, 0)
+        self.failedMethods = set() # Methods that failed once are not tried again
+        if useHardLinks:
+            self.failedMethods.add('symlink')
+
+    def isCurrent(self, linkName, fileName):
+        path = getStoragePath(fileName, self.sharded)
+        fullName = join(self.targetDirectory, path)
+        try:
+            if islink(linkName):
+                from os import readlink # pylint: disable=E0611
+                return readlink(linkName) == join('..', path)
+            return samefile(linkName, fullName) or getsize(linkName) == getsize(fullName) and getmtime(linkName) >= getmtime(fullName) # Clone or copy
+        except Exception:
+            return False
+
+    def materialize(self, method, linkName, fileName):
+        path = getStoragePath(fileName, self.sharded)
+        fullName = join(self.targetDirectory, path) # Hard link and copy source paths are relative to the current directory, not to the link
+        if method == 'symlink':
+            if not symlink:
+                raise OSError("Symbolic links are not available")
+            symlink(join('..', path), linkName)
+        elif method == 'hardlink':
+            if not hardlink:
+                raise OSError("Hard links are not available")
+            hardlink(fullName, linkName)
+        elif method == 'reflink':
+            reflink(fullName, linkName)
+        else:
+            kernelCopy(fullName, linkName)
+
+    def link(self, linkName, fileName, action):
+        if 'symlink' in self.failedMethods and not isfile(join(self.targetDirectory, getStoragePath(fileName, self.sharded))): # Not downloaded (yet)
+            self.counts['missing'] += 1
+            return
+        errors = []
+        for method in self.MATERIALIZERS:
+            if method in self.failedMethods:
+                continue
+            try:
+                self.materialize(method, linkName, fileName)
+            except Exception as e:
+                errors.append('%s: %s' % (method, e))
+                if method != 'copy' and getattr(e, 'errno', None) in (None,) + self.UNSUPPORTED_ERRORS: # Not only this file can't be linked this way
+                    self.failedMethods.add(method)
+                if lexists(linkName):
+                    remove(linkName)
+                continue
+            if errors:
+                self.logger.warning("Using %s at %s, %s", method, encodeForConsole(linkName), '; '.join(errors))
+            self.methods[method] += 1
+            self.counts[action] += 1
+            return
+        self.logger.warning("Can't create link at %s: %s", encodeForConsole(linkName), '; '.join(errors))
+        self.counts['failed'] += 1
+
+    def remove(self, linkName, countRemoved = True):
+        try:
+            remove(linkName)
+        except Exception as e:
+            self.logger.warning("Can't remove link at %s: %s", encodeForConsole(linkName), e)
+            self.counts['failed'] += 1
+            return False
+        if countRemoved:
+            self.counts['removed'] += 1
+        return True
+
+    def reconcile(self, dirName, fileNames, members, prune):
+        '''Links fileNames {vID: file name} into dirName, reading the directory once.
+
+        Links to members of the folder that are not in fileNames are kept, links to other videos are removed if prune is set.'''
+        existing = {}
+        for linkFileName in listdir(unicode(dirName)):
+            m = search(VIDEO_FILE_PATTERN, linkFileName)
+            if m:
+                existing[linkFileName] = int(m.group(1))
+        for (linkFileName, vID) in existing.items():
+            if vID in fileNames:
+                if linkFileName != fileNames[vID]: # Video title has changed
+                    self.remove(join(dirName, linkFileName))
+            elif prune and vID not in members:
+                self.remove(join(dirName, linkFileName))
+        for fileName in fileNames.values():
+            linkName = join(dirName, fileName) # unicode
+            if fileName not in existing:
+                self.link(linkName, fileName, 'created')
+            elif self.isCurrent(linkName, fileName):
+                self.counts['unchanged'] += 1
+            elif self.remove(linkName, False):
+                self.link(linkName, fileName, 'retargeted')
+
+    def getSummary(self):
+        return ', '.join('%d %s' % (self.counts[action], action) for action in self.ACTIONS) \
+             + ''.join(', %d by %s' % (self.methods[method], method) for method in self.MATERIALIZERS if self.methods[method])
+
+class DriverPool(object):
+    '''Additional WebDriver instances, sharing the main driver session, used to load pages in parallel.'''
+    def __init__(self, createDriver, size, controller = None):
+        self.createDriver = createDriver
+        self.size = size
+        self.controller = controller
+        self.drivers = []
+        self.idleDrivers = Queue()
+
+    def getDriver(self):
+        try:
+            return self.idleDrivers.get_nowait()
+        except Empty:
+            driver = self.createDriver()
+            self.drivers.append(driver)
+            return driver
+
+    def map(self, function, args):
+        '''Calls function(driver, arg) for every arg in parallel and returns the results in the order of args.'''
+        tasks = Queue()
+        for task in enumerate(args):
+            tasks.put(task)
+        results = [None] * tasks.qsize()
+        errors = []
+        def worker():
+            driver = None # Created on the first task, so that drivers above the concurrency limit are never started
+            try:
+                while not errors:
+                    try:
+                        (index, arg) = tasks.get_nowait()
+                    except Empty:
+                        break
+                    if self.controller:
+                        self.controller.acquire()
+                    try:
+                        driver = driver or self.getDriver()
+                        startTime = time()
+                        results[index] = function(driver, arg)
+                    finally:
+                        if self.controller:
+                            self.controller.release(time() - startTime if driver else None)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                if driver:
+                    self.idleDrivers.put(driver)
+        threads = tuple(Thread(target = worker) for _ in xrange(min(self.size, len(results))))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def close(self):
+        for driver in self.drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        self.drivers = []
+        self.idleDrivers = Queue()
+
+class DriverMonitor(object):
+    '''Page count, memory use and page load latency of the main browser, telling when it should be restarted.'''
+    LATENCY_WINDOW = 20 # Pages to average latency over
+    MEMORY_CHECK_INTERVAL = 10 # Pages between memory checks
+    COOKIE_SAVE_INTERVAL = 50 # Pages between saving the session cookies, to start a new browser with if this one crashes
+
+    def __init__(self, maxPages, maxMemory, maxDrift):
+        self.maxPages = maxPages
+        self.maxMemory = maxMemory
+        self.maxDrift = maxDrift
+        self.restarts = {} # { reason: count }
+        self.reset(None)
+
+    def reset(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.latencies = []
+        self.baseline = self.latency = None # Mean latency of the first and the last window
+
+    def add(self, latency):
+        self.pages += 1
+        self.latencies.append(latency)
+        if len(self.latencies) >= self.LATENCY_WINDOW:
+            self.latency = sum(self.latencies) / len(self.latencies)
+            self.baseline = self.baseline or self.latency
+            self.latencies = []
+
+    def getRestartReason(self):
+        '''Returns (reason, details) to restart the browser before loading the next page, or None.'''
+        if self.maxPages and self.pages >= self.maxPages:
+            return ('pages', "%d pages loaded" % self.pages)
+        if self.maxDrift and self.baseline and self.latency > self.baseline * self.maxDrift:
+            return ('latency', "page loads slowed from %.2fs to %.2fs" % (self.baseline, self.latency))
+        if self.maxMemory and self.pages and not self.pages % self.MEMORY_CHECK_INTERVAL:
+            memory = getBrowserMemory(self.driver)
+            if memory and memory > self.maxMemory:
+                return ('memory', "%s of memory used" % readableSize(memory))
+        return None
+
+    def getReport(self):
+        return "Browser restarts: %s" % ', '.join('%d %s' % (count, reason) for (reason, count) in sorted(self.restarts.items()))
+
+class DriverTracer(object):
+    '''Collects timings of WebDriver commands issued through TracingProxy.'''
+    TRACED_PROPERTIES = ('current_url', 'text') # Properties that make a round trip to the browser
+    TOP_SELECTORS = 10
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.records = [] # (vID or None, command, selector, duration, found)
+        self.lock = Lock()
+        self.state = local() # Video being resolved by the current thread
+
+    def setVideo(self, vID):
+        self.state.vID = vID
+
+    def add(self, command, selector, duration, found):
+        vID = getattr(self.state, 'vID', None)
+        self.logger.debug("Trace: %s(%s) %.3fs %s", command, selector, duration, 'found' if found else 'NOT FOUND')
+        with self.lock:
+            self.records.append((vID, command, selector, duration, found))
+
+    def getReport(self):
+        totalTime = sum(record[3] for record in self.records)
+        misses = tuple(record for record in self.records if not record[4])
+        perVideo = {}
+        for record in self.records:
+            if record[0] is not None:
+                perVideo[record[0]] = perVideo.get(record[0], 0) + 1
+        selectors = {}
+        for (_vID, command, selector, duration, found) in self.records:
+            stats = selectors.setdefault((command, selector), [0, 0, 0, 0]) # calls, misses, total time, max time
+            stats[0] += 1
+            stats[1] += not found
+            stats[2] += duration
+            stats[3] = max(stats[3], duration)
+        lines = ["Trace: %d browser commands in %.1fs, %d missing elements lost %.1fs" % (len(self.records), totalTime, len(misses), sum(record[3] for record in misses))]
+        if perVideo:
+            lines.append("Commands per video: %.1f average, %d max, %d for listing pages" % (float(sum(perVideo.values())) / len(perVideo), max(perVideo.values()),
+                         len(self.records) - sum(perVideo.values())))
+        lines.append("Slowest selectors (total, max, calls, misses):")
+        lines.extend("%8.1fs %6.2fs %5d %5d  %s(%s)" % (stats[2], stats[3], stats[0], stats[1], command, selector)
+                     for ((command, selector), stats) in sorted(selectors.items(), key = lambda item: -item[1][2])[:self.TOP_SELECTORS])
+        return '\n'.join(lines)
+
+class TracingProxy(object):
+    '''Wraps WebDriver or WebElement, reporting every command to DriverTracer, elements found are wrapped too.'''
+    def __init__(self, target, tracer):
+        self._target = target
+        self._tracer = tracer
+
+    def _wrap(self, value):
+        if isinstance(value, list):
+            return [self._wrap(v) for v in value]
+        return TracingProxy(value, self._tracer) if hasattr(value, 'find_elements_by_css_selector') else value
+
+    def __getattr__(self, name):
+        if name in DriverTracer.TRACED_PROPERTIES:
+            startTime = time()
+            value = getattr(self._target, name)
+            self._tracer.add(name, '', time() - startTime, True)
+            return value
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+        def command(*args, **kwargs):
+            selector = args[0] if args and not isinstance(args[0], dict) else '' # Cookies are not selectors
+            startTime = time()
+            try:
+                result = value(*args, **kwargs)
+            except NoSuchElementException:
+                self._tracer.add(name, selector, time() - startTime, False)
+                raise
+            self._tracer.add(name, selector, time() - startTime, bool(result) or not name.startswith('find_elements'))
+            return self._wrap(result)
+        return command
 
 class VimeoCrawler(object):
     def __init__(self, args):
@@ -225,15 +1836,66 @@ class VimeoCrawler(object):
         self.verbose = False
         self.doDownload = True
         self.foldersNeeded = True
-        self.getFileSizes = bool(requests)
+        self.getFileSizes = True
+        self.probeSizes = True
         self.useHardLinks = False
+        self.useDirectLinks = True
+        self.useIndex = True
+        self.libraryIndex = None
+        self.revalidate = False
+        self.linkResolver = None
+        self.renditionPolicy = None
+        self.maxVideoSize = None
+        self.sizeBudget = None
+        self.preferFormat = None
+        self.reserveSpace = '1GB'
+        self.downloaderName = None
+        self.writeBufferSize = None
+        self.syncPolicy = SYNC_POLICIES[0]
+        self.minSpeed = '10KB'
+        self.minSpeedTime = 60
+        self.benchmark = None
+        self.manifestFileName = None
+        self.manifestSource = None
+        self.queueFileName = None
+        self.reportFileName = None
+        self.jsonLogFileName = None
         self.setPreset = False
         self.setHD = False
         self.verifyContent = False
+        self.ffmpegChecked = False
         # Selenium WebDriver settings
         self.driver = None
         self.driverName = 'Firefox'
         self.driverClass = None
+        self.driverPool = None
+        self.workerCount = 1
+        self.pageController = None
+        self.downloadCount = 1
+        self.downloadController = None
+        self.resolveLock = Lock() # The main driver can't be shared by parallel downloads
+        self.doTrace = False
+        self.tracer = None
+        self.selectorRegistry = None
+        self.recyclePages = 1000
+        self.recycleMemory = None
+        self.recycleLatency = 3
+        self.driverMonitor = None
+        self.sessionCookies = None # Main browser cookies saved last, carried over to its replacement if it crashes
+        self.cacheTTL = 3600
+        self.refreshCache = False
+        self.listingCache = None
+        self.sharded = False
+        self.migrateLayout = None
+        self.daemonFileName = None
+        self.pollInterval = '1h'
+        self.pollTargets = ()
+        self.statusPort = None
+        self.statusServer = None
+        self.daemonState = None
+        self.daemonStarted = None
+        self.pollCount = 0
+        self.queuedCount = 0
         # Options with parameters
         self.credentials = None
         self.targetDirectory = '.'
@@ -241,7 +1903,8 @@ class VimeoCrawler(object):
         self.retryCount = 3
         self.maxItems = None
         self.setLanguage = None
-        self.startURL = None
+        self.startURLs = []
+        self.batchFileName = None
         try:
             # Reading command line options
             (options, parameters) = getopt(args, SHORT_OPTIONS, LONG_OPTIONS)
@@ -262,23 +1925,32 @@ class VimeoCrawler(object):
                     self.useHardLinks = True
                 elif option in ('--hd',):
                     self.setHD = True
+                elif option in ('--no-direct-links',):
+                    self.useDirectLinks = False
+                elif option in ('--no-index',):
+                    self.useIndex = False
+                elif option in ('--revalidate',):
+                    self.revalidate = True
+                elif option in ('--refresh',):
+                    self.refreshCache = True
+                elif option in ('--sharded',):
+                    self.sharded = True
+                elif option in ('--trace',):
+                    self.doTrace = True
                 else: # Parsing options with arguments
                     index = None
                     for (maskNum, mask) in enumerate(('-([^-])', '--(.*)')):
                         m = match(mask, option)
                         if not m:
                             continue
-                        index = tuple(OPTION_NAMES.index(option) for option in OPTION_NAMES if (option if maskNum else option[0]) == m.group(1))
+                        optionNames = OPTION_NAMES + LONG_OPTION_NAMES if maskNum else OPTION_NAMES
+                        index = tuple(optionNames.index(option) for option in optionNames if (option if maskNum else option[0]) == m.group(1))
                         break
                     else:
                         assert False # This should never happen
                     assert len(index) == 1
-                    setattr(self, FIELD_NAMES[index[0]], value)
+                    setattr(self, (FIELD_NAMES + LONG_FIELD_NAMES)[index[0]], value)
             # Processing command line options
-            driverTuple = DRIVERS.get(self.driverName.lower())
-            if not driverTuple:
-                raise ValueError("Unknown driver %s, valid values are: %s" % (self.driverName, '/'.join(sorted(x[0] for x in DRIVERS.itervalues()))))
-            (self.driverName, self.driverClass) = driverTuple
             if self.credentials:
                 try:
                     index = self.credentials.index(':', self.credentials.index('@'))
@@ -304,57 +1976,250 @@ class VimeoCrawler(object):
                     raise ValueError
             except ValueError:
                 raise ValueError("-r / --retries parameter must be a non-negative integer")
+            try:
+                self.workerCount = int(self.workerCount)
+                if self.workerCount < 1:
+                    raise ValueError
+            except ValueError:
+                raise ValueError("--workers parameter must be a positive integer")
+            try:
+                self.downloadCount = int(self.downloadCount)
+                if self.downloadCount < 1:
+                    raise ValueError
+            except ValueError:
+                raise ValueError("--downloads parameter must be a positive integer")
+            try:
+                self.recyclePages = int(self.recyclePages)
+                if self.recyclePages < 0:
+                    raise ValueError
+            except ValueError:
+                raise ValueError("--recycle-pages parameter must be a non-negative integer")
+            try:
+                self.recycleLatency = float(self.recycleLatency)
+                if self.recycleLatency and self.recycleLatency <= 1:
+                    raise ValueError
+            except ValueError:
+                raise ValueError("--recycle-latency parameter must be 0 or a number larger than 1")
+            if self.recycleMemory:
+                self.recycleMemory = parseSize(self.recycleMemory)
+            self.minSpeed = parseSize(self.minSpeed) if self.minSpeed not in ('0', 0) else 0
+            try:
+                self.minSpeedTime = int(self.minSpeedTime)
+                if self.minSpeedTime < 1:
+                    raise ValueError
+            except ValueError:
+                raise ValueError("--min-speed-time parameter must be a positive integer")
+            try:
+                self.cacheTTL = int(self.cacheTTL)
+                if self.cacheTTL < 0:
+                    raise ValueError
+            except ValueError:
+                raise ValueError("--cache-ttl parameter must be a non-negative integer")
+            try:
+                self.pollInterval = parseDuration(self.pollInterval)
+                if self.pollInterval < 1:
+                    raise ValueError
+            except ValueError:
+                raise ValueError("--poll-interval parameter must be a positive duration, like 900, 30m or 6h")
+            if self.statusPort:
+                try:
+                    self.statusPort = int(self.statusPort)
+                    if not 0 < self.statusPort < 65536:
+                        raise ValueError
+                except ValueError:
+                    raise ValueError("--status-port parameter must be a port number")
+                if not self.daemonFileName:
+                    raise ValueError("--status-port requires --daemon")
             if self.setLanguage:
                 self.setLanguage = self.setLanguage.capitalize()
-            if len(parameters) > 1:
-                raise Exception("Too many parameters")
+            self.reserveSpace = parseSize(self.reserveSpace)
+            if self.writeBufferSize:
+                self.writeBufferSize = parseSize(self.writeBufferSize)
+            if not self.downloaderName:
+                self.downloaderName = 'pycurl' if self.writeBufferSize else DEFAULT_DOWNLOADER
+            if self.revalidate and not self.useIndex:
+                raise ValueError("--revalidate requires the library index, it can't be used with --no-index")
+            if self.downloaderName not in DOWNLOADERS:
+                raise ValueError("--downloader parameter must be one of: %s" % '/'.join(DOWNLOADERS))
+            if self.syncPolicy not in SYNC_POLICIES:
+                raise ValueError("--fsync parameter must be one of: %s" % '/'.join(SYNC_POLICIES))
+            if self.benchmark and self.benchmark not in BENCHMARKS:
+                raise ValueError("--benchmark parameter must be one of: %s" % '/'.join(BENCHMARKS))
+            if self.migrateLayout and self.migrateLayout not in LAYOUTS:
+                raise ValueError("--migrate parameter must be one of: %s" % '/'.join(LAYOUTS))
+            if self.maxVideoSize:
+                self.maxVideoSize = parseSize(self.maxVideoSize)
+            if self.sizeBudget:
+                self.sizeBudget = parseSize(self.sizeBudget)
+            if self.maxVideoSize or self.sizeBudget or self.preferFormat:
+                if (self.maxVideoSize or self.sizeBudget) and not self.getFileSizes:
+                    raise ValueError("--max-size and --budget require file sizes, which are disabled")
+                self.renditionPolicy = RenditionPolicy(self.maxVideoSize, self.sizeBudget, self.preferFormat)
+            if self.batchFileName:
+                with open(self.batchFileName) as f:
+                    parameters += [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+            if parameters and self.manifestSource:
+                raise ValueError("Start URL can't be used with --from-manifest")
+            if self.reportFileName and (self.queueFileName or self.daemonFileName):
+                raise ValueError("--report can't be used with --queue or --daemon")
+            if self.daemonFileName:
+                if parameters or self.manifestSource or self.queueFileName:
+                    raise ValueError("--daemon can't be used with start URLs, --from-manifest or --queue, list the start URLs in the daemon file")
+                self.pollTargets = readPollTargets(self.daemonFileName, self.pollInterval)
             if parameters:
-                self.startURL = URL(parameters[0])
-            elif not self.credentials:
+                self.startURLs = [URL(parameter) for parameter in parameters]
+                self.startURLs = [url for (n, url) in enumerate(self.startURLs) if url.url not in (u.url for u in self.startURLs[:n])]
+            elif not self.credentials and not self.benchmark and not self.migrateLayout and not self.manifestSource and not self.queueFileName and not self.pollTargets:
                 raise ValueError("Neither login credentials nor start URL is specified")
             # Creating target directory
             self.createDir()
-            if self.startURL:
-                self.startURL.createFile(self.targetDirectory)
+            if self.migrateLayout:
+                pass
+            elif isSharded(self.targetDirectory):
+                self.sharded = True
+            elif self.sharded:
+                if scanLibrary(self.targetDirectory):
+                    raise ValueError("Target directory contains a flat library, convert it with --migrate=sharded first")
+                self.createDir(SHARD_DIRECTORY_NAME)
+            if len(self.startURLs) == 1:
+                self.startURLs[0].createFile(self.targetDirectory)
             # Configuring logging
             rootLogger = getLogger()
             if not rootLogger.handlers:
                 formatter = Formatter("%(asctime)s %(levelname)s %(message)s", '%Y-%m-%d %H:%M:%S')
-                streamHandler = StreamHandler()
+                streamHandler = StreamHandler() # Synchronous, as it shares the console with the download progress indicator
                 streamHandler.setFormatter(formatter)
-                fileHandler = FileHandler(join(self.targetDirectory, LOG_FILE_NAME), mode = 'w')
+                fileHandler = RotatingFileHandler(self.getLogFileName(join(self.targetDirectory, LOG_FILE_NAME)), maxBytes = LOG_MAX_SIZE, backupCount = LOG_BACKUP_COUNT)
                 fileHandler.setFormatter(formatter)
+                fileHandlers = [fileHandler]
+                if self.jsonLogFileName:
+                    jsonHandler = RotatingFileHandler(self.getLogFileName(self.jsonLogFileName), maxBytes = LOG_MAX_SIZE, backupCount = LOG_BACKUP_COUNT)
+                    jsonHandler.setFormatter(JSONLogFormatter())
+                    fileHandlers.append(jsonHandler)
+                asyncHandler = AsyncLogHandler(*fileHandlers)
+                asyncHandler.addFilter(logContext)
                 rootLogger.addHandler(streamHandler)
-                rootLogger.addHandler(fileHandler)
+                rootLogger.addHandler(asyncHandler)
             rootLogger.setLevel(DEBUG if self.verbose else WARNING)
             self.logger = getLogger('vimeo')
             self.logger.setLevel(DEBUG if self.verbose else INFO)
             self.logger.info(TITLE)
-            if self.verifyContent:
-                self.logger.info("Enabling content verification, checking for ffmpeg...")
-                subprocess = Popen('ffmpeg', shell = True, stdout = PIPE, stderr = STDOUT)
-                if subprocess.returncode:
-                    self.logger.error("FAILED (code %d), content verification NOT enabled", subprocess.returncode)
-                    self.verifyContent = False
-                else:
-                    self.logger.info("OK")
-        except Exception, e:
+            if self.doTrace:
+                self.tracer = DriverTracer(self.logger)
+        except Exception as e:
             usage("ERROR: %s\n" % e)
 
+    def getLogFileName(self, fileName):
+        '''Returns the log file name for this process, rotating a log shared by several processes would lose their backups.'''
+        if not self.queueFileName:
+            return fileName
+        (name, extension) = splitext(fileName)
+        return WORKER_LOG_FILE_NAME % (name, gethostname(), getpid(), extension)
+
     def createDir(self, dirName = None):
         dirName = join(self.targetDirectory, dirName) if dirName else self.targetDirectory
         if dirName and not isdir(dirName):
-            makedirs(dirName)
+            try:
+                makedirs(dirName)
+            except OSError: # Created by a parallel download meanwhile
+                if not isdir(dirName):
+                    raise
         return dirName
 
-    def goTo(self, url):
+    def getTargetFileName(self, fileName):
+        return encodeForFileSystem(join(self.targetDirectory, getStoragePath(fileName, self.sharded)))
+
+    def checkFFmpeg(self):
+        '''Checks for ffmpeg on first verification, returns True if content verification is enabled.'''
+        if self.verifyContent and not self.ffmpegChecked:
+            self.ffmpegChecked = True
+            self.logger.info("Enabling content verification, checking for ffmpeg...")
+            subprocess = Popen('ffmpeg -version', shell = True, stdout = PIPE, stderr = STDOUT)
+            subprocess.communicate()
+            if subprocess.returncode:
+                self.logger.error("FAILED (code %d), content verification NOT enabled", subprocess.returncode)
+                self.verifyContent = False
+            else:
+                self.logger.info("OK")
+        return self.verifyContent
+
+    def createDriver(self, cookies = None):
+        '''Starts a browser sharing the main driver session, by its cookies or the specified ones.'''
+        driver = self.driverClass() # ToDo: Provide parameters to the driver
+        if self.tracer:
+            driver = TracingProxy(driver, self.tracer)
+        if cookies is None and self.driver:
+            cookies = self.driver.get_cookies()
+        if cookies:
+            driver.get(VIMEO_URL % '')
+            for cookie in cookies:
+                driver.add_cookie(dict((key, cookie[key]) for key in ('name', 'value', 'path', 'secure') if key in cookie))
+        return driver
+
+    def goTo(self, url, driver = None):
         url = URL(url)
+        if driver or not self.driverMonitor: # Parallel workers' browsers are not monitored
+            self.logger.info("Going to %s", url)
+            (driver or self.driver).get(url.url)
+            return
+        reason = self.driverMonitor.getRestartReason()
+        if reason:
+            self.restartDriver(*reason)
         self.logger.info("Going to %s", url)
-        self.driver.get(url.url)
+        startTime = time()
+        try:
+            self.driver.get(url.url)
+        except WebDriverException as e:
+            self.restartDriver('crash', "browser failed: %s" % e)
+            self.driver.get(url.url)
+        self.driverMonitor.add(time() - startTime)
+        if not self.driverMonitor.pages % DriverMonitor.COOKIE_SAVE_INTERVAL:
+            self.sessionCookies = self.driver.get_cookies()
+
+    def restartDriver(self, reason, details):
+        '''Replaces the main browser with a new one, carrying the session cookies over.
+
+        Cookies of a crashed browser can't be read, the ones saved last are used then, or the login is repeated.'''
+        self.logger.info("Restarting %s: %s", self.driverName, details)
+        oldDriver = self.driver
+        try:
+            self.sessionCookies = oldDriver.get_cookies()
+        except WebDriverException:
+            self.logger.warning("Can't read the session cookies, %s", 'using the ones saved last' if self.sessionCookies else 'no cookies are saved')
+        self.driver = self.createDriver(self.sessionCookies or ())
+        try:
+            oldDriver.quit()
+        except Exception:
+            pass
+        self.driverMonitor.reset(self.driver)
+        self.driverMonitor.restarts[reason] = self.driverMonitor.restarts.get(reason, 0) + 1
+        if not self.sessionCookies and self.credentials:
+            self.login(*self.credentials)
 
     def getElement(self, css):
         return self.driver.find_element_by_css_selector(css)
 
+    def getText(self, pageType, selectors):
+        '''Returns the text or attribute of the first element found with selectors, trying the best scoring ones first.
+
+        Returns None if elements are found but empty, raises NoSuchElementException if none are found.'''
+        error = None
+        for selector in self.selectorRegistry.order(pageType, selectors):
+            (css, _, attribute) = selector.partition('@')
+            try:
+                element = self.getElement(css)
+            except NoSuchElementException as e:
+                error = error or e
+                continue
+            text = element.get_attribute(attribute) if attribute else element.text
+            if text:
+                self.selectorRegistry.hit(pageType, selector)
+                return text
+            error = None
+        if error:
+            raise error
+        return None
+
     def login(self, email, password):
         for _ in xrange(self.retryCount):
             self.goTo('http://vimeo.com/log_in')
@@ -366,18 +2231,20 @@ class VimeoCrawler(object):
                 self.getElement('#menu .me a').click()
                 sleep(1) # prevents occasional login fails
                 self.loggedIn = True
+                self.sessionCookies = self.driver.get_cookies()
                 return
-            except NoSuchElementException, e:
+            except NoSuchElementException as e:
                 self.logger.error("Login failed: %s", e.msg)
         self.errors += 1
 
-    def getItemsFromPage(self):
-        self.logger.info("Processing %s", self.driver.current_url)
+    def getItemsFromPage(self, driver = None):
+        driver = driver or self.driver
+        self.logger.info("Processing %s", driver.current_url)
         try:
-            links = self.driver.find_elements_by_css_selector('#browse_content .browse a')
+            links = driver.find_elements_by_css_selector('#browse_content .browse a')
             links = (link.get_attribute('href') for link in links)
             items = tuple(URL(link) for link in links if VIMEO in link and not link.endswith('settings'))[:self.maxItems]
-        except NoSuchElementException, e:
+        except NoSuchElementException as e:
             self.logger.error(e.msg)
             self.errors += 1
             items = ()
@@ -392,23 +2259,67 @@ class VimeoCrawler(object):
         assert len(items) == len(set(items))
         return items
 
+    def getItemsFromPageURL(self, driver, url):
+        self.goTo(url, driver)
+        return self.getItemsFromPage(driver)
+
+    def getPageURLs(self):
+        '''Returns URLs of the rest of the pages of the current listing, derived from its pagination block, or None if they can't be derived.'''
+        links = (link.get_attribute('href') for link in self.driver.find_elements_by_css_selector('.pagination a'))
+        pages = tuple((int(m.group(1)), link) for (m, link) in ((search(PAGE_NUMBER_PATTERN, link), link) for link in links if link) if m)
+        if not pages:
+            return None if self.driver.find_elements_by_css_selector('.pagination a[rel=next]') else ()
+        m = search(PAGE_NUMBER_PATTERN, self.driver.current_url)
+        currentPage = int(m.group(1)) if m else 1
+        (lastPage, link) = max(pages)
+        m = search(PAGE_NUMBER_PATTERN, link)
+        return tuple(link[:m.start(1)] + str(page) + link[m.end(1):] for page in xrange(currentPage + 1, lastPage + 1))
+
     def getItemsFromFolder(self):
         items = []
-        for _ in xrange(self.maxItems) if self.maxItems != None else count():
+        if self.driverPool and self.maxItems != 0:
             items.extend(self.getItemsFromPage())
-            try:
-                self.getElement('.pagination a[rel=next]').click()
-            except NoSuchElementException:
-                break
+            remaining = self.maxItems - 1 if self.maxItems != None else None # Pages left to load
+            pageURLs = self.getPageURLs()
+            while pageURLs and remaining != 0:
+                pageURLs = pageURLs[:remaining]
+                self.logger.info("Loading %d more pages with %d workers", len(pageURLs), self.workerCount)
+                for pageItems in self.driverPool.map(self.getItemsFromPageURL, pageURLs):
+                    items.extend(pageItems)
+                if remaining != None:
+                    remaining -= len(pageURLs)
+                    if not remaining:
+                        break
+                # Pagination may only show a window of pages, the last one tells whether there are more
+                self.goTo(pageURLs[-1])
+                pageURLs = self.getPageURLs() if self.driver.find_elements_by_css_selector('.pagination a[rel=next]') else ()
+            if pageURLs is None: # Pagination can't be parsed, clicking through it
+                pages = xrange(remaining) if remaining != None else count()
+                for _ in pages:
+                    try:
+                        self.getElement('.pagination a[rel=next]').click()
+                    except NoSuchElementException:
+                        break
+                    items.extend(self.getItemsFromPage())
+        else:
+            for _ in xrange(self.maxItems) if self.maxItems != None else count():
+                items.extend(self.getItemsFromPage())
+                try:
+                    self.getElement('.pagination a[rel=next]').click()
+                except NoSuchElementException:
+                    break
         items = tuple(items)
         assert len(items) == len(set(items))
         return items
 
     def getItemsFromURL(self, url = None, target = None):
+        logContext.set(phase = 'crawl')
+        if self.tracer:
+            self.tracer.setVideo(None)
         url = URL(url or self.driver.current_url)
-        if not self.startURL:
-            self.startURL = url
-            self.startURL.createFile(self.targetDirectory)
+        if not self.startURLs: # Account of the login credentials
+            self.startURLs.append(url)
+            url.createFile(self.targetDirectory)
         items = ()
         if url.isVideo: # Video
             if url.vID not in self.vIDs:
@@ -416,351 +2327,997 @@ class VimeoCrawler(object):
             if target != None:
                 target.add(url.vID)
         elif url.isAccount: # Account main page
-            self.goTo(url.url + '/videos')
             self.logger.info("Processing account %s", url.account)
-            items = self.getItemsFromFolder() + (url.url + '/channels', url.url + '/albums')
+            (_title, items) = self.getListing(url, lambda: (None, self.goTo(url.url + '/videos') or self.getItemsFromFolder() + (url.url + '/channels', url.url + '/albums')))
             self.doCreateFolders = self.foldersNeeded
         elif url.isVideos: # Videos
-            self.goTo(url)
-            items = self.getItemsFromFolder()
+            (_title, items) = self.getListing(url, lambda: (None, self.goTo(url) or self.getItemsFromFolder()))
         elif url.isCategory: # Category
-            self.goTo(url)
-            items = self.getItemsFromFolder()
+            (_title, items) = self.getListing(url, lambda: (None, self.goTo(url) or self.getItemsFromFolder()))
             self.doCreateFolders = self.foldersNeeded
         elif url.isFolder: # Folder
-            title = None
-            for i in xrange(self.retryCount + 1):
-                self.goTo(url)
-                try:
-                    title = self.getElement('#page_header h1 a').text
-                except NoSuchElementException:
-                    try:
-                        title = self.getElement('#page_header h1').text
-                    except NoSuchElementException:
-                        try:
-                            title = self.getElement('#group_header h1 a').get_attribute('title')
-                        except NoSuchElementException:
-                            try:
-                                title = self.getElement('#group_header h1 a').text
-                            except NoSuchElementException, e:
-                                self.logger.warning(e.msg)
-                                if i >= self.retryCount:
-                                    self.logger.error("Page load failed")
-                                    self.errors += 1
-                if title:
-                    self.logger.info("Folder: %s", encodeForConsole(title))
-                    if self.doCreateFolders:
-                        dirName = self.createDir(cleanupFileName(title.strip().rstrip('.'))) # unicode
-                        url.createFile(dirName)
-                        if symlink:
-                            target = set()
-                            self.folders.append((dirName, target))
-                    items = self.getItemsFromFolder()
-                    break
+            (title, items) = self.getListing(url, lambda: self.getFolder(url))
+            if title:
+                self.logger.info("Folder: %s", encodeForConsole(title))
+                if self.doCreateFolders:
+                    dirName = self.createDir(cleanupFileName(title.strip().rstrip('.'))) # unicode
+                    if dirName in (folderDirName for (folderDirName, _members) in self.folders): # Already reached from another start URL
+                        return
+                    url.createFile(dirName)
+                    target = set()
+                    self.folders.append((dirName, target))
         else: # Some other page
-            self.goTo(url)
-            items = self.getItemsFromPage()
+            (_title, items) = self.getListing(url, lambda: (None, self.goTo(url) or self.getItemsFromPage()))
         for item in items:
             self.getItemsFromURL(item, target)
 
-    def processVideo(self, vID, number):
-        for _attempt in xrange(self.retryCount):
-            title = ''
-            download = None
+    def getFolder(self, url):
+        '''Loads the folder page, returns (title, items), title is None if the page failed to load.'''
+        for i in xrange(self.retryCount + 1):
+            self.goTo(url)
+            try:
+                title = self.getText('folder/' + url.folder, FOLDER_TITLE_SELECTORS)
+            except NoSuchElementException as e:
+                self.logger.warning(e.msg)
+                if i >= self.retryCount:
+                    self.logger.error("Page load failed")
+                    self.errors += 1
+                continue
+            if title:
+                return (title, self.getItemsFromFolder())
+        return (None, ())
+
+    def getListing(self, url, load):
+        '''Returns (title, items) of the listing page as already loaded in this crawl from another start URL,
+        or from the listing cache, or loads them with load() and caches them.'''
+        if url.url in self.crawledListings: # Not loading the page again, but its folder and members are still registered
+            return self.crawledListings[url.url]
+        record = self.listingCache.get(url) if self.listingCache and not self.refreshCache else None
+        if record:
+            self.logger.info("Using listing of %s cached %d minutes ago", url, (time() - record['time']) // 60)
+            self.crawledListings[url.url] = (record['title'], tuple(record['items']))
+            return self.crawledListings[url.url]
+        errors = self.errors
+        (title, items) = load()
+        if self.listingCache and self.errors == errors and (title or items): # Failed listings are not cached
+            self.listingCache.put(url, title, items)
+        self.crawledListings[url.url] = (title, items)
+        return (title, items)
+
+    def getLinkSize(self, link, userAgent, cookies):
+        try:
+            request = requests.get(link, stream = True, headers = { 'user-agent': userAgent }, cookies = dict((str(cookie['name']), str(cookie['value'])) for cookie in cookies))
+            request.close()
+            return int(request.headers['content-length'])
+        except Exception as e:
+            self.logger.warning(e)
+            return None
+
+    def getRenditionsFromDialog(self, download):
+        '''Returns the renditions linked from the download dialog, ordered by FILE_PREFERENCES.
+
+        All the links are read at once, looking each version up by its link text would wait for every missing one.'''
+        renditions = []
+        for link in download.find_elements_by_tag_name('a'):
+            text = link.text # unicode
+            url = str(link.get_attribute('href'))
+            if preferenceIndex(text) < len(FILE_PREFERENCES) and url not in (rendition.url for rendition in renditions):
+                renditions.append(Rendition(text, link.get_attribute('download').split('.')[-1], None, url, None))
+        renditions.sort(key = lambda rendition: preferenceIndex(rendition.quality))
+        return tuple(renditions if self.renditionPolicy else renditions[:1]) # Only the best one is needed
+
+    def resolveVideo(self, job):
+        '''Locates the video download link, fills in the job accordingly and applies the video settings.'''
+        vID = job.vID
+        logContext.set(vID, 'resolve')
+        if self.tracer:
+            self.tracer.setVideo(vID)
+        userAgent = cookies = None
+        title = ''
+        download = rendition = pageLoaded = None
+        renditions = ()
+        if self.linkResolver:
+            try:
+                self.logger.info("Resolving %s", URL(vID))
+                (title, renditions) = self.linkResolver.resolve(vID)
+                title = encodeForConsole(title.strip().rstrip('.'))
+                (userAgent, cookies) = (self.userAgent, self.cookies)
+            except Exception as e:
+                self.logger.warning("Direct link resolution failed, using download dialog: %s", e)
+        if not renditions:
             for i in count():
                 try:
                     self.goTo(vID)
+                    pageLoaded = True
                     title = encodeForConsole(self.getElement('#page_header h1').text.strip().rstrip('.'))
                     self.driver.find_element_by_class_name('iconify_down_b').click()
                     download = self.getElement('#download')
                     break
-                except NoSuchElementException, e:
+                except NoSuchElementException as e:
                     self.logger.warning(e.msg)
                     if i >= self.retryCount:
                         self.logger.error("Page load failed")
                         self.errors += 1
                         break
-            # Parse download links
-            link = linkSize = localSize = downloadOK = downloadSkip = None
-            if download:
-                for preference in FILE_PREFERENCES:
-                    try:
-                        link = download.find_element_by_partial_link_text(preference)
-                        break
-                    except NoSuchElementException:
-                        pass
-            if link: # Parse chosen download link
+        # Parse download links
+        link = linkSize = None
+        if download:
+            renditions = self.getRenditionsFromDialog(download)
+            if renditions:
                 userAgent = str(self.driver.execute_script('return window.navigator.userAgent'))
                 cookies = self.driver.get_cookies()
-                extension = link.get_attribute('download').split('.')[-1] # unicode
-                description = encodeForConsole('%s/%s' % (link.text, extension.upper()))
-                link = str(link.get_attribute('href'))
-                if self.getFileSizes:
-                    try:
-                        request = requests.get(link, stream = True, headers = { 'user-agent': userAgent }, cookies = dict((str(cookie['name']), str(cookie['value'])) for cookie in cookies))
-                        request.close()
-                        linkSize = int(request.headers['content-length'])
-                        self.totalFileSize += linkSize
-                        description += ', %s' % readableSize(linkSize)
-                    except Exception, e:
-                        self.logger.warning(e)
+        if renditions: # Choose download link
+            if self.renditionPolicy:
+                if self.renditionPolicy.needsSizes:
+                    renditions = tuple(r if r.size else r._replace(size = self.getLinkSize(str(r.url), userAgent, cookies)) for r in renditions)
+                rendition = self.renditionPolicy.choose(vID, renditions)
+                job.policySkip = not rendition
             else:
-                description = extension = 'NONE'
-            # Prepare file information
-            prefix = ' '.join((title, '(%s)' % description))
-            suffix = ' '.join((('%d/%d %d%%' % (number, len(self.vIDs), int(number * 100.0 / len(self.vIDs)))),)
-                            + ((readableSize(self.totalFileSize),) if self.totalFileSize else ()))
-            self.logger.info(' '.join((prefix, suffix)))
-            fileName = cleanupFileName('%s.%s' % (' '.join(((title.decode(CONSOLE_ENCODING),) if title else ()) + (str(vID),)), extension.lower())) # unicode
-            targetFileName = encodeForFileSystem(join(self.targetDirectory, fileName))
-            if self.setLanguage or self.setPreset or self.setHD:
-                try:
-                    self.driver.find_element_by_id('change_settings').click()
-                    if self.setLanguage:
+                rendition = renditions[0]
+        if rendition: # Parse chosen download link
+            extension = rendition.extension
+            description = encodeForConsole('%s/%s' % (rendition.quality, extension.upper()))
+            link = str(rendition.url)
+            linkSize = rendition.size or (self.getLinkSize(link, userAgent, cookies) if self.probeSizes else None)
+            if linkSize:
+                self.totalFileSize += linkSize
+                description += ', %s' % readableSize(linkSize)
+        else:
+            description = extension = 'NONE'
+        # Prepare file information
+        prefix = ' '.join((title, '(%s)' % description))
+        suffix = ' '.join((('%d/%d %d%%' % (job.number, len(self.vIDs), int(job.number * 100.0 / len(self.vIDs)))),)
+                        + ((readableSize(self.totalFileSize),) if self.totalFileSize else ()))
+        self.logger.info(' '.join((prefix, suffix)))
+        fileName = cleanupFileName('%s.%s' % (' '.join(((decodeFromConsole(title),) if title else ()) + (str(vID),)), extension.lower())) # unicode
+        (job.title, job.fileName, job.link, job.linkSize, job.userAgent, job.cookies) = (title, fileName, link, linkSize, userAgent, cookies)
+        job.linkTime = time()
+        (job.quality, job.extension) = (rendition.quality, extension) if rendition else (None, None)
+        job.targetFileName = self.getTargetFileName(fileName)
+        if self.setLanguage or self.setPreset or self.setHD:
+            if not pageLoaded: # Settings are only available from the video page
+                self.goTo(vID)
+            try:
+                self.driver.find_element_by_id('change_settings').click()
+                if self.setLanguage:
+                    try:
+                        languages = self.driver.find_elements_by_css_selector('select[name=language] option')
+                        currentLanguage = ([l for l in languages if l.is_selected()] or [None,])[0]
+                        if currentLanguage is None or currentLanguage is languages[0]:
+                            ls = [l for l in languages if l.text.capitalize().startswith(self.setLanguage)]
+                            if len(ls) != 1:
+                                ls = [l for l in languages if l.get_attribute('value').capitalize().startswith(self.setLanguage)]
+                            if len(ls) == 1:
+                                self.logger.info("Language not set, setting to %s", ls[0].text)
+                                ls[0].click()
+                                self.driver.find_element_by_css_selector('#settings_form input[type=submit]').click()
+                            else:
+                                self.logger.error("Unsupported language: %s", self.setLanguage)
+                                self.setLanguage = None
+                        else:
+                            self.logger.info("Language is already set to %s / %s", currentLanguage.get_attribute('value').upper(), currentLanguage.text)
+                    except NoSuchElementException:
+                        self.logger.warning("Failed to set language to %s", self.setLanguage)
+                if self.setHD:
+                    try:
+                        self.driver.find_element_by_css_selector('#tabs a[title="Video File"]').click()
                         try:
-                            languages = self.driver.find_elements_by_css_selector('select[name=language] option')
-                            currentLanguage = ([l for l in languages if l.is_selected()] or [None,])[0]
-                            if currentLanguage is None or currentLanguage is languages[0]:
-                                ls = [l for l in languages if l.text.capitalize().startswith(self.setLanguage)]
-                                if len(ls) != 1:
-                                    ls = [l for l in languages if l.get_attribute('value').capitalize().startswith(self.setLanguage)]
-                                if len(ls) == 1:
-                                    self.logger.info("Language not set, setting to %s", ls[0].text)
-                                    ls[0].click()
-                                    self.driver.find_element_by_css_selector('#settings_form input[type=submit]').click()
-                                else:
-                                    self.logger.error("Unsupported language: %s", self.setLanguage)
-                                    self.setLanguage = None
+                            for i in xrange(self.retryCount):
+                                try:
+                                    radio = self.driver.find_element_by_id('hd_profile_1080')
+                                    break
+                                except NoSuchElementException as e:
+                                    if i == self.retryCount - 1:
+                                        raise
+                            if radio.is_selected():
+                                self.logger.info("Video already set to 1080p")
+                            elif not radio.is_enabled():
+                                self.logger.info("Video cannot be set to 1080p")
                             else:
-                                self.logger.info("Language is already set to %s / %s", currentLanguage.get_attribute('value').upper(), currentLanguage.text)
+                                self.logger.info("Setting video to 1080p")
+                                radio.click()
+                                self.driver.find_element_by_id('upgrade_video').click()
                         except NoSuchElementException:
-                            self.logger.warning("Failed to set language to %s", self.setLanguage)
-                    if self.setHD:
-                        try:
-                            self.driver.find_element_by_css_selector('#tabs a[title="Video File"]').click()
+                            self.logger.warning("Failed to set video to 1080p")
+                    except NoSuchElementException:
+                        self.logger.warning("Failed to access Video File settings")
+                if self.setPreset or self.setHD:
+                    try:
+                        self.driver.find_element_by_css_selector('#tabs a[title=Embed]').click()
+                        if self.setHD:
                             try:
                                 for i in xrange(self.retryCount):
                                     try:
-                                        radio = self.driver.find_element_by_id('hd_profile_1080')
+                                        checkbox = self.driver.find_element_by_css_selector('input[name=allow_hd_embed]')
                                         break
-                                    except NoSuchElementException, e:
+                                    except NoSuchElementException as e:
                                         if i == self.retryCount - 1:
                                             raise
-                                if radio.is_selected():
-                                    self.logger.info("Video already set to 1080p")
-                                elif not radio.is_enabled():
-                                    self.logger.info("Video cannot be set to 1080p")
+                                if checkbox.is_selected():
+                                    self.logger.info("Embed already set to HD")
                                 else:
-                                    self.logger.info("Setting video to 1080p")
-                                    radio.click()
-                                    self.driver.find_element_by_id('upgrade_video').click()
+                                    self.logger.info("Setting embed to HD")
+                                    checkbox.click()
+                                    self.driver.find_element_by_css_selector('#settings_form input[name=save_embed_settings]').click()
                             except NoSuchElementException:
-                                self.logger.warning("Failed to set video to 1080p")
-                        except NoSuchElementException:
-                            self.logger.warning("Failed to access Video File settings")
-                    if self.setPreset or self.setHD:
-                        try:
-                            self.driver.find_element_by_css_selector('#tabs a[title=Embed]').click()
-                            if self.setHD:
-                                try:
-                                    for i in xrange(self.retryCount):
-                                        try:
-                                            checkbox = self.driver.find_element_by_css_selector('input[name=allow_hd_embed]')
-                                            break
-                                        except NoSuchElementException, e:
-                                            if i == self.retryCount - 1:
-                                                raise
-                                    if checkbox.is_selected():
-                                        self.logger.info("Embed already set to HD")
-                                    else:
-                                        self.logger.info("Setting embed to HD")
-                                        checkbox.click()
+                                self.logger.warning("Failed to set playback to HD")
+                        if self.setPreset:
+                            try:
+                                for i in xrange(self.retryCount):
+                                    try:
+                                        presets = self.driver.find_elements_by_css_selector("select#preset option")
+                                        break
+                                    except NoSuchElementException as e:
+                                        if i == self.retryCount - 1:
+                                            raise
+                                currentPreset = ([p for p in presets if p.is_selected()] or [None,])[0]
+                                if currentPreset and currentPreset.text.capitalize() == self.setPreset:
+                                    self.logger.info("Preset is already set to %s", self.setPreset)
+                                else:
+                                    presets = [p for p in presets if p.text.capitalize() == self.setPreset]
+                                    if presets:
+                                        self.logger.info("Preset %s, setting to %s", ('is set to %s' % currentPreset.text.capitalize()) if currentPreset else 'is not set', self.setPreset)
+                                        presets[0].click()
                                         self.driver.find_element_by_css_selector('#settings_form input[name=save_embed_settings]').click()
-                                except NoSuchElementException:
-                                    self.logger.warning("Failed to set playback to HD")
-                            if self.setPreset:
-                                try:
-                                    for i in xrange(self.retryCount):
-                                        try:
-                                            presets = self.driver.find_elements_by_css_selector("select#preset option")
-                                            break
-                                        except NoSuchElementException, e:
-                                            if i == self.retryCount - 1:
-                                                raise
-                                    currentPreset = ([p for p in presets if p.is_selected()] or [None,])[0]
-                                    if currentPreset and currentPreset.text.capitalize() == self.setPreset:
-                                        self.logger.info("Preset is already set to %s", self.setPreset)
                                     else:
-                                        presets = [p for p in presets if p.text.capitalize() == self.setPreset]
-                                        if presets:
-                                            self.logger.info("Preset %s, setting to %s", ('is set to %s' % currentPreset.text.capitalize()) if currentPreset else 'is not set', self.setPreset)
-                                            presets[0].click()
-                                            self.driver.find_element_by_css_selector('#settings_form input[name=save_embed_settings]').click()
-                                        else:
-                                            self.logger.error("Unknown preset: %s", self.setPreset)
-                                            self.setPreset = None
-                                except NoSuchElementException:
-                                    self.logger.warning("Failed to set preset to %s", self.setPreset)
-                        except NoSuchElementException:
-                            self.logger.warning("Failed to access Embed settings")
-                except NoSuchElementException:
-                    self.logger.warning("Failed to access settings")
-            if link: # Downloading file
-                if linkSize:
-                    localSize = getFileSize(targetFileName)
-                    if localSize == linkSize:
-                        downloadOK = True
-                    elif localSize > linkSize:
-                        self.errors += 1
-                        self.logger.error("Local file is larger (%d) than remote file (%d)", localSize, linkSize)
-                        downloadSkip = True
-                        #remove(targetFileName)
-                        #localSize = None
-                if self.doDownload and not downloadSkip and not downloadOK:
-                    timeout = self.timeout
-                    class ProgressIndicator(object):
-                        QUANTUM = 10 * 1024 * 1024 # 10 megabytes
-                        ACTION = r'--\\||//' # update() often gets called in pairs, this smoothes things up
-                        action = len(ACTION) - 1
-
-                        def progress(self, s, suffix = ''):
-                            self.action = (self.action + 1) % len(self.ACTION)
-                            stdout.write('\b%s%s' % (s, suffix + '\n' if suffix else self.ACTION[self.action]))
-
-                        def start(self, *_args, **kwargs):
-                            self.length = kwargs.get('length') or kwargs.get('size')
-                            self.started = False
-                            self.totalRead = 0
-                            self.lastData = time()
-                            self.count = 0
-                            self.action = len(self.ACTION) - 1
-                            self.progress("Dowloading: ")
-
-                        def update(self, totalRead, suffix = ''):
-                            if totalRead == 0:
-                                self.started = True
-                            elif totalRead <= self.totalRead:
-                                if time() > self.lastData + timeout: # pylint: disable=W0640
-                                    raise URLGrabError("Download seems stalled")
-                            else:
-                                self.totalRead = totalRead
-                                self.lastData = time()
-                            oldCount = self.count
-                            self.count = int(totalRead // self.QUANTUM) + 1
-                            self.progress(('=' if self.started else '+') * max(0, self.count - oldCount), suffix)
-                            self.started = True
-
-                        def end(self, totalRead):
-                            self.update(totalRead, 'OK')
-
-                    progressIndicator = ProgressIndicator()
-                    grabber = URLGrabber(reget = 'simple', timeout = self.timeout, progress_obj = progressIndicator,
-                        user_agent = userAgent, http_headers = tuple((str(cookie['name']), str(cookie['value'])) for cookie in cookies))
-                    try:
-                        grabber.urlgrab(link, filename = targetFileName)
-                        downloadOK = True
-                    except URLGrabError, e:
+                                        self.logger.error("Unknown preset: %s", self.setPreset)
+                                        self.setPreset = None
+                            except NoSuchElementException:
+                                self.logger.warning("Failed to set preset to %s", self.setPreset)
+                    except NoSuchElementException:
+                        self.logger.warning("Failed to access Embed settings")
+            except NoSuchElementException:
+                self.logger.warning("Failed to access settings")
+        return job
+
+    def resolveFromIndex(self, job):
+        '''Fills in the job from the library index if the video file is complete on disk, returns True if so.
+
+        Video settings are only applied from the video page, so with settings to apply the page is visited anyway.'''
+        if self.manifestFileName or self.queueFileName: # Other hosts need the links, and check their own library index
+            return False
+        record = self.libraryIndex.getComplete(job.vID) if self.libraryIndex and not (self.setLanguage or self.setPreset or self.setHD) else None
+        if not record:
+            return False
+        if self.revalidate:
+            return self.revalidateVideo(job, record)
+        (job.title, job.fileName, job.linkSize) = (encodeForConsole(record['title']), record['fileName'], record['size'])
+        job.extension = job.fileName.split('.')[-1]
+        job.targetFileName = self.getTargetFileName(job.fileName)
+        job.downloaded = True
+        self.totalFileSize += job.linkSize
+        self.logger.info("%s (on disk, %s) %d/%d", encodeForConsole(job.fileName), readableSize(job.linkSize), job.number, len(self.vIDs))
+        return True
+
+    def isComplete(self, job):
+        '''Returns True if the file of the job read from a manifest or queue is complete on this host, according to its library index.'''
+        record = self.libraryIndex.getComplete(job.vID) if self.libraryIndex else None
+        return bool(record) and record['fileName'] == job.fileName
+
+    def isModified(self, job, record):
+        '''Asks the server with a conditional request whether the video file has changed since the library index record was made.
+
+        Returns True or False, or None if it can't be told. Only the response headers are read.'''
+        headers = { 'user-agent': job.userAgent }
+        if record.get('etag'):
+            headers['if-none-match'] = record['etag']
+        if record.get('lastModified'):
+            headers['if-modified-since'] = record['lastModified']
+        try:
+            response = requests.get(job.link, stream = True, headers = headers, timeout = self.timeout or None,
+                                    cookies = dict((str(cookie['name']), str(cookie['value'])) for cookie in job.cookies or ()))
+            response.close()
+        except Exception as e:
+            self.logger.warning(e)
+            return None
+        if response.status_code == 304:
+            return False
+        if response.status_code >= 400:
+            self.logger.warning("HTTP Error %d", response.status_code)
+            return None
+        # The server may ignore conditional requests, comparing the headers then
+        for (field, header) in VALIDATOR_HEADERS:
+            if record.get(field) and response.headers.get(header):
+                return response.headers[header] != record[field]
+        length = response.headers.get('content-length')
+        return int(length) != record['size'] if length and length.isdigit() else None
+
+    def revalidateVideo(self, job, record):
+        '''Locates the video download link and checks whether the file complete on disk has changed on the server, returns True.'''
+        self.resolveVideo(job)
+        modified = self.isModified(job, record) if job.link and job.fileName == record['fileName'] else None
+        self.revalidation[REVALIDATION_RESULTS[2 if modified is None else int(modified)]] += 1
+        if modified is None:
+            self.logger.warning("File on disk can't be revalidated")
+        elif modified:
+            self.logger.info("File has changed on the server since downloaded")
+            job.modified = True
+        else:
+            self.logger.info("File is not modified on the server")
+            job.downloaded = True
+        return True
+
+    def downloadVideo(self, job):
+        '''Downloads the video file if needed, returns (downloadOK, downloadSkip).'''
+        (link, linkSize, targetFileName, userAgent, cookies) = (job.link, job.linkSize, job.targetFileName, job.userAgent, job.cookies)
+        localSize = downloadOK = downloadSkip = None
+        job.checksum = None
+        if linkSize:
+            localSize = getFileSize(targetFileName)
+            if localSize == linkSize:
+                downloadOK = True
+            elif localSize and localSize > linkSize:
+                self.errors += 1
+                self.logger.error("Local file is larger (%d) than remote file (%d)", localSize, linkSize)
+                downloadSkip = True
+                #remove(targetFileName)
+                #localSize = None
+        if self.doDownload and not downloadSkip and not downloadOK:
+            downloader = transferStart = None
+            try:
+                if self.sharded:
+                    self.createDir(dirname(getStoragePath(job.fileName, True)))
+                progressIndicator = ProgressIndicator(self.timeout, self.downloadCount > 1, self.minSpeed, self.minSpeedTime)
+                downloader = DOWNLOADER_CLASSES[self.downloaderName](link, targetFileName, linkSize, userAgent, cookies, self.timeout, progressIndicator,
+                                                                     self.writeBufferSize or parseSize(DEFAULT_WRITE_BUFFER), self.syncPolicy, self.reserveSpace)
+                if self.downloadController:
+                    self.downloadController.waitPause()
+                transferStart = time()
+                downloader.perform()
+                job.validators = downloader.getValidators()
+                job.checksum = downloader.getChecksum()
+                downloadOK = True
+            except InsufficientSpaceError as e:
+                self.logger.warning("%s, downloading DEFERRED", e)
+                job.deferred = True
+                self.deferredCount += 1
+                self.deferredSize += e.need
+            except DownloadError as e:
+                downloadSkip = downloader and downloader.remoteSize is not None and downloader.offset > downloader.remoteSize # Local file is larger
+                if downloadSkip:
+                    self.errors += 1
+                    self.logger.error("Download failed: %s", e)
+                else: # Counted as an error only if no retry succeeds, the link may have expired
+                    job.failed = True
+                    self.logger.warning("Download failed: %s", e)
+                if isinstance(e, StalledDownloadError):
+                    job.stalls += 1
+                if e.status in THROTTLE_STATUSES and self.downloadController:
+                    self.downloadController.throttle("HTTP %d" % e.status, parseRetryAfter(e.retryAfter))
+            except KeyboardInterrupt:
+                self.errors += 1
+                self.logger.error("Download interrupted")
+            if transferStart:
+                (job.latency, job.transferTime) = (downloader.latency, job.transferTime + time() - transferStart)
+            if downloader and downloader.remoteSize and not linkSize: # Size is learned from the download response
+                job.linkSize = linkSize = downloader.remoteSize
+            if downloadOK:
+                localSize = getFileSize(targetFileName)
+                if not localSize:
+                    self.errors += 1
+                    downloadOK = False
+                    self.logger.error("Downloaded file seems corrupt")
+                elif linkSize:
+                    if localSize > linkSize:
                         self.errors += 1
-                        self.logger.error("Download failed: %s", e)
-                    except KeyboardInterrupt:
+                        downloadOK = False
+                        self.logger.error("Downloaded file larger (%d) than remote file (%d)", localSize, linkSize)
+                    elif localSize < linkSize:
                         self.errors += 1
-                        self.logger.error("Download interrupted")
-                    if downloadOK:
-                        localSize = getFileSize(targetFileName)
-                        if not localSize:
-                            self.errors += 1
-                            downloadOK = False
-                            self.logger.error("Downloaded file seems corrupt")
-                        elif linkSize:
-                            if localSize > linkSize:
-                                self.errors += 1
-                                downloadOK = False
-                                self.logger.error("Downloaded file larger (%d) than remote file (%d)", localSize, linkSize)
-                            elif localSize < linkSize:
-                                self.errors += 1
-                                downloadOK = False
-                                self.logger.error("Downloaded file smaller (%d) than remote file (%d)", localSize, linkSize)
-                            elif self.verifyContent: # Verifying downloaded file
-                                self.logger.info("Verifying...")
-                                subprocess = Popen('ffmpeg -v error -i "%s" -f null -' % targetFileName, shell = True, stdout = PIPE, stderr = STDOUT)
-                                output = subprocess.communicate()[0]
-                                if subprocess.returncode:
-                                    self.logger.warning("Verification failed, code %d", subprocess.returncode)
-                                elif output:
-                                    self.logger.error("Verification ERROR: %s", '\n'.join([s for s in output.splitlines() if "Last message repeated" not in s][-4:]))
+                        downloadOK = False
+                        self.logger.error("Downloaded file smaller (%d) than remote file (%d)", localSize, linkSize)
+                    elif self.checkFFmpeg(): # Verifying downloaded file
+                        self.logger.info("Verifying...")
+                        subprocess = Popen('ffmpeg -v error -i "%s" -f null -' % targetFileName, shell = True, stdout = PIPE, stderr = STDOUT, universal_newlines = True)
+                        output = subprocess.communicate()[0]
+                        if subprocess.returncode:
+                            self.logger.warning("Verification failed, code %d", subprocess.returncode)
+                        elif output:
+                            self.logger.error("Verification ERROR: %s", '\n'.join([s for s in output.splitlines() if "Last message repeated" not in s][-4:]))
+        return (downloadOK, downloadSkip)
+
+    def processVideo(self, job):
+        '''Downloads the video and creates its folder links, returns True if nothing is left to do about the video,
+        or None if the download was too slow and should be retried after the other videos.'''
+        logContext.set(job.vID, 'download')
+        self.logger.info("Processing %d/%d: %s", job.number, len(self.vIDs), encodeForConsole(job.fileName))
+        success = False
+        oldFileName = job.targetFileName + OLD_FILE_SUFFIX
+        if job.modified and self.doDownload and lexists(job.targetFileName) and not lexists(oldFileName): # Keeping the old file until the new one is complete
+            rename(job.targetFileName, oldFileName)
+        for attempt in xrange(self.retryCount):
+            if job.downloaded:
+                self.logger.info("File is complete according to the library index, downloading SKIPPED")
+                success = True
+                break
+            if self.driver and (attempt or job.linkTime and time() - job.linkTime > LINK_MAX_AGE): # The link may have expired since, locating it again
+                with self.resolveLock:
+                    self.resolveVideo(job)
+            if job.policySkip:
+                self.logger.info("No file version fits the rendition policy, downloading SKIPPED")
+                success = True
+                break
+            if job.deferred:
+                self.logger.info("Not enough free space, downloading DEFERRED")
+                break
+            if job.link:
+                (downloadOK, downloadSkip) = self.downloadVideo(job)
+                if job.deferred: # Found not to fit once the response told the size
+                    break
                 if downloadOK:
+                    if self.libraryIndex and (job.validators or not self.libraryIndex.getComplete(job.vID)): # Not recording the same file again
+                        self.libraryIndex.add(job)
                     self.logger.info("OK")
+                    success = True
                     break
                 elif downloadSkip or not self.doDownload:
                     self.logger.info("Downloading SKIPPED")
+                    success = not downloadSkip
                     break
+                elif job.stalls >= DEGRADED_RESTARTS and not job.requeued:
+                    self.logger.warning("Download is too slow, retrying after the other videos")
+                    job.requeued = True
+                    success = None
+                    break
+                elif job.stalls:
+                    self.logger.info("Restarting the download on a fresh connection")
         else:
             self.logger.info("Download ultimately failed after %d retries", self.retryCount)
-        # Creating symbolic links, if enabled
-        for dirName in (dirName for (dirName, vIDs) in self.folders if vID in vIDs):
-            linkFileName = join(dirName, fileName) # unicode
+            if job.failed:
+                self.errors += 1
+        if lexists(oldFileName):
+            if success:
+                remove(oldFileName)
+            else: # Restoring the old file
+                if lexists(job.targetFileName):
+                    remove(job.targetFileName)
+                rename(oldFileName, job.targetFileName)
+        return success
+
+    def processJobs(self, jobs):
+        '''Processes the jobs, downloading as many videos in parallel as the download concurrency controller allows.'''
+        if self.downloadCount == 1:
+            for job in [job for job in jobs if self.processVideo(job) is None]: # Slow downloads, retried after the others
+                self.processVideo(job)
+            return
+        tasks = Queue()
+        for job in jobs:
+            tasks.put(job)
+        errors = []
+        def worker():
             try:
-                if lexists(linkFileName):
-                    remove(linkFileName)
-            except:
-                pass
+                while not errors:
+                    try:
+                        job = tasks.get_nowait()
+                    except Empty:
+                        break
+                    if job.downloaded or job.policySkip or job.deferred or not job.link or not self.doDownload: # Nothing to download
+                        self.processVideo(job)
+                        continue
+                    self.downloadController.acquire()
+                    (job.latency, job.transferTime, startSize) = (None, 0, getFileSize(job.targetFileName) or 0)
+                    try:
+                        if self.processVideo(job) is None: # Slow download, retried after the others
+                            tasks.put(job)
+                    finally:
+                        self.downloadController.release(job.latency, max(0, (getFileSize(job.targetFileName) or 0) - startSize), job.transferTime)
+            except Exception as e:
+                errors.append(e)
+        threads = tuple(Thread(target = worker) for _ in xrange(min(self.downloadCount, len(jobs))))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def linkFolders(self, jobs, prune):
+        '''Creates, retargets and removes folder links to match folder contents, if enabled.'''
+        if not self.folders:
+            return
+        logContext.set(phase = 'link')
+        self.logger.info("Updating links in %d folders...", len(self.folders))
+        fileNames = dict((job.vID, job.fileName) for job in jobs if job.extension) # Videos with a file version located
+        reconciler = LinkReconciler(self.targetDirectory, self.useHardLinks, self.logger, self.sharded)
+        for (dirName, vIDs) in self.folders:
+            reconciler.reconcile(dirName, dict((vID, fileNames[vID]) for vID in vIDs if vID in fileNames), vIDs, prune)
+        self.logger.info("Folder links: %s", reconciler.getSummary())
+        self.errors += reconciler.counts['failed']
+
+    def processQueue(self, queue):
+        '''Claims video jobs from the shared work queue and processes them, until no jobs are available.'''
+        owner = '%s:%d' % (gethostname(), getpid())
+        self.vIDs = queue.getVIDs()
+        self.logger.info("Processing work queue %s as %s", self.queueFileName, owner)
+        jobs = []
+        for number in count(1):
+            record = queue.claim(owner)
+            if not record:
+                break
+            job = VideoJob.fromRecord(record, number)
+            job.targetFileName = self.getTargetFileName(job.fileName)
+            job.downloaded = self.isComplete(job)
+            self.addFolders(job.vID, record.get('folders', ()))
+            jobs.append(job)
+            leaseKeeper = LeaseKeeper(queue, job.vID, owner)
+            leaseKeeper.start()
+            success = False
             try:
-                (hardlink if self.useHardLinks else symlink)(join('..', fileName), linkFileName)
-            except Exception, e:
-                self.logger.warning("Can't create link at %s: %s", encodeForConsole(linkFileName), e)
-                self.errors += 1
+                self.planStorage((job,))
+                success = self.processVideo(job)
+            finally:
+                leaseKeeper.stop()
+                queue.finish(job.vID, owner, success, self.retryCount)
+        self.linkFolders(jobs, False) # Other workers' videos are unknown here
+        self.logger.info("Work queue: %s", ', '.join('%d %s' % (n, state) for (state, n) in queue.getCounts()))
 
-    def removeDuplicates(self):
-        self.logger.info("Checking for duplicate files...")
-        files = {}
-        for fileName in listdir(unicode(self.targetDirectory)):
-            if '.' not in fileName:
+    def addFolders(self, vID, folders):
+        if not self.foldersNeeded:
+            return
+        for folder in folders:
+            dirName = self.createDir(folder)
+            for (name, vIDs) in self.folders:
+                if name == dirName:
+                    vIDs.add(vID)
+                    break
+            else:
+                self.folders.append((dirName, set((vID,))))
+
+    def getJobFolders(self, job):
+        return sorted(relpath(dirName, self.targetDirectory) for (dirName, vIDs) in self.folders if job.vID in vIDs)
+
+    def planStorage(self, jobs):
+        '''Admits for downloading only the videos that fit into the free space of the target directory.'''
+        freeSpace = getFreeSpace(self.targetDirectory)
+        if freeSpace is None:
+            self.logger.warning("Free space in the target directory is unknown, downloads are not planned")
+            return
+        available = freeSpace - self.reserveSpace
+        needed = unknown = 0
+        for job in jobs:
+            if not job.link or job.policySkip:
                 continue
-            fullName = join(self.targetDirectory, fileName)
-            if not isfile(fullName):
+            if not job.linkSize:
+                unknown += 1
                 continue
-            keyName = str(fileName[fileName.rfind(' ') + 1 : fileName.rfind('.')])
-            files[keyName] = files.get(keyName, []) + [(fileName, fullName),]
-        for (keyName, fullNames) in files.iteritems():
-            assert fullNames
-            if len(fullNames) == 1:
+            need = max(0, job.linkSize - (getFileSize(job.targetFileName) or 0))
+            if need > available:
+                job.deferred = True
+                self.deferredCount += 1
+                self.deferredSize += need
+            else:
+                available -= need
+                needed += need
+        self.logger.info("Storage plan: %s to download, %s free, %s reserved", readableSize(needed), readableSize(freeSpace), readableSize(self.reserveSpace))
+        if unknown:
+            self.logger.warning("%d videos of unknown size are not planned", unknown)
+        if self.deferredCount:
+            self.logger.warning("%d videos (%s) don't fit and are DEFERRED", self.deferredCount, readableSize(self.deferredSize))
+
+    def reconcileLibrary(self, jobs):
+        '''Compares the crawled videos and folder members with the video files and folder links on disk
+        and writes the differences to the --report file.
+
+        Sides are compared as sets of video IDs, from one scan of the library and of every folder, files are not opened.
+        Files are only told complete by the library index, which checks the size and time of the files it has records of,
+        unless they were already found complete in this run.'''
+        logContext.set(phase = 'report')
+        remote = dict((job.vID, job) for job in jobs)
+        local = scanLibrary(self.targetDirectory, self.sharded)
+        records = self.libraryIndex.records if self.libraryIndex else {}
+        entries = []
+        for vID in sorted(set(local) - set(remote)):
+            entries.append({ 'result': 'orphaned', 'vID': vID, 'files': sorted(local[vID]) })
+        for vID in sorted(set(remote) - set(local)):
+            job = remote[vID]
+            reason = 'deferred' if job.deferred else 'skipped by policy' if job.policySkip else 'no link' if not job.link else 'not downloaded'
+            entries.append({ 'result': 'missing', 'vID': vID, 'fileName': job.fileName, 'reason': reason })
+        for vID in sorted(set(remote) & set(local)):
+            job = remote[vID]
+            if job.fileName and job.fileName not in local[vID]: # Title has changed
+                entries.append({ 'result': 'mismatched', 'vID': vID, 'problem': 'name', 'expected': job.fileName, 'found': sorted(local[vID]) })
+            record = records.get(vID)
+            if record and job.linkSize and record['size'] != job.linkSize:
+                entries.append({ 'result': 'mismatched', 'vID': vID, 'problem': 'size', 'expected': job.linkSize, 'found': record['size'] })
+            if self.libraryIndex and not job.downloaded and not self.libraryIndex.getComplete(vID): # Partial or failed download, or changed since recorded
+                entries.append({ 'result': 'mismatched', 'vID': vID, 'problem': 'incomplete', 'files': sorted(local[vID]) })
+        for (dirName, vIDs) in self.folders:
+            linked = set(scanLibrary(dirName)) if isdir(dirName) else set()
+            (unlinked, extra) = ((set(vIDs) & set(local)) - linked, linked - set(vIDs))
+            if unlinked or extra:
+                entries.append({ 'result': 'mismatched', 'problem': 'folder', 'folder': relpath(dirName, self.targetDirectory), 'unlinked': sorted(unlinked), 'extra': sorted(extra) })
+        with open(self.reportFileName, 'w') as f:
+            for entry in entries:
+                f.write(dumps(entry, sort_keys = True) + '\n')
+        counts = dict((result, sum(1 for entry in entries if entry['result'] == result)) for result in RECONCILIATION_RESULTS)
+        self.logger.info("Reconciliation of %d remote and %d local videos: %s, written to %s", len(remote), len(local),
+                         ', '.join('%d %s' % (counts[result], result) for result in RECONCILIATION_RESULTS), self.reportFileName)
+
+    def removeDuplicates(self):
+        self.logger.info("Checking for duplicate files...")
+        for fileNames in scanLibrary(self.targetDirectory, self.sharded).values():
+            fullNames = [(fileName, join(self.targetDirectory, getStoragePath(fileName, self.sharded))) for fileName in fileNames]
+            fullNames = [(fileName, fullName) for (fileName, fullName) in fullNames if isfile(fullName)]
+            if len(fullNames) < 2:
                 continue
-            for (fileName, fullName) in sorted(fullNames, key = lambda (fileName, fullName): (getsize(fullName), getmtime(fullName)))[:-1]:
+            for (fileName, fullName) in sorted(fullNames, key = lambda names: (getsize(names[1]), getmtime(names[1])))[:-1]:
                 self.logger.info("Duplicate detected, suggested removal: %s", encodeForConsole(fileName))
                 #remove(fullName)
         self.logger.info("Done")
 
+    def migrate(self):
+        '''Moves the video files to the --migrate layout and retargets the symbolic links in the subfolders to them.
+
+        Files are looked up in the other layout only, so running it again completes an interrupted migration.'''
+        sharded = self.migrateLayout == 'sharded'
+        self.logger.info("Migrating the library in %s to %s layout...", self.targetDirectory, self.migrateLayout)
+        moved = 0
+        for fileNames in scanLibrary(self.targetDirectory, not sharded).values():
+            for fileName in fileNames:
+                (sourcePath, targetPath) = (getStoragePath(fileName, not sharded), getStoragePath(fileName, sharded))
+                if lexists(join(self.targetDirectory, targetPath)):
+                    self.logger.error("Can't move %s, %s exists", encodeForConsole(sourcePath), encodeForConsole(targetPath))
+                    self.errors += 1
+                    continue
+                self.createDir(dirname(targetPath))
+                rename(join(self.targetDirectory, sourcePath), join(self.targetDirectory, targetPath))
+                moved += 1
+        self.logger.info("Moved %d video files", moved)
+        if not sharded: # Removing the emptied shards
+            shardRoot = join(self.targetDirectory, SHARD_DIRECTORY_NAME)
+            try:
+                for shard in listdir(shardRoot):
+                    rmdir(join(shardRoot, shard))
+                rmdir(shardRoot)
+            except OSError as e:
+                if isdir(shardRoot):
+                    self.logger.error("Can't remove %s, the library is still detected as sharded: %s", shardRoot, e)
+                    self.errors += 1
+        if not symlink:
+            return
+        from os import readlink # pylint: disable=E0611
+        retargeted = 0
+        for name in listdir(unicode(self.targetDirectory)):
+            dirName = join(unicode(self.targetDirectory), name)
+            if name == SHARD_DIRECTORY_NAME or islink(dirName) or not isdir(dirName):
+                continue
+            for linkFileName in listdir(dirName):
+                linkName = join(dirName, linkFileName)
+                if not search(VIDEO_FILE_PATTERN, linkFileName) or not islink(linkName):
+                    continue
+                target = join('..', getStoragePath(linkFileName, sharded))
+                if readlink(linkName) != target:
+                    remove(linkName)
+                    symlink(target, linkName)
+                    retargeted += 1
+        self.logger.info("Retargeted %d folder links", retargeted)
+
+    def benchmarkWrite(self):
+        chunk = urandom(CURL_CHUNK_SIZE) # Data arrives from curl in such pieces
+        fileName = join(self.targetDirectory, BENCHMARK_FILE_NAME)
+        def plainWrite():
+            with open(fileName, 'wb') as f:
+                for _ in xrange(BENCHMARK_SIZE // len(chunk)):
+                    f.write(chunk)
+                f.flush()
+                fsync(f.fileno())
+        def bufferedWrite():
+            writer = FileWriter(fileName, BENCHMARK_SIZE, 0, self.writeBufferSize or parseSize(DEFAULT_WRITE_BUFFER), 'end')
+            for _ in xrange(BENCHMARK_SIZE // len(chunk)):
+                writer.write(chunk)
+            writer.close()
+        self.logger.info("Writing %s in %s pieces, fsync at the end", readableSize(BENCHMARK_SIZE), readableSize(len(chunk)))
+        try:
+            for (name, function) in (("Plain file", plainWrite), ("FileWriter", bufferedWrite)):
+                startTime = time()
+                function()
+                duration = time() - startTime
+                self.logger.info("%s: %.1f MB/s", name, BENCHMARK_SIZE / duration / 1024 / 1024)
+                remove(fileName)
+        except Exception as e:
+            self.logger.error("Benchmark failed: %s", e)
+            self.errors += 1
+        finally:
+            if lexists(fileName):
+                remove(fileName)
+
+    def benchmarkMaterialize(self):
+        sourceName = join(self.targetDirectory, BENCHMARK_FILE_NAME)
+        targetName = sourceName + '.folder'
+        self.logger.info("Materializing %s with every method of putting a file into a folder", readableSize(BENCHMARK_SIZE))
+        try:
+            chunk = urandom(CURL_CHUNK_SIZE)
+            with open(sourceName, 'wb') as f:
+                for _ in xrange(BENCHMARK_SIZE // len(chunk)):
+                    f.write(chunk)
+                f.flush()
+                fsync(f.fileno())
+            reconciler = LinkReconciler(self.targetDirectory, False, self.logger)
+            for method in LinkReconciler.MATERIALIZERS:
+                try:
+                    startTime = time()
+                    reconciler.materialize(method, targetName, BENCHMARK_FILE_NAME)
+                    duration = max(time() - startTime, 0.000001)
+                    self.logger.info("%s: %.3f s, %.1f MB/s", method, duration, BENCHMARK_SIZE / duration / 1024 / 1024)
+                except Exception as e:
+                    self.logger.info("%s: not available: %s", method, e)
+                finally:
+                    if lexists(targetName):
+                        remove(targetName)
+        except Exception as e:
+            self.logger.error("Benchmark failed: %s", e)
+            self.errors += 1
+        finally:
+            if lexists(sourceName):
+                remove(sourceName)
+
+    def benchmarkDownload(self):
+        sourceName = join(self.targetDirectory, BENCHMARK_FILE_NAME)
+        fileName = sourceName + '.download'
+        server = None
+        self.logger.info("Downloading %s from a local HTTP server with every downloader", readableSize(BENCHMARK_SIZE))
+        try:
+            chunk = urandom(CURL_CHUNK_SIZE)
+            with open(sourceName, 'wb') as f:
+                for _ in xrange(BENCHMARK_SIZE // len(chunk)):
+                    f.write(chunk)
+            with open(devnull, 'w') as null:
+                server = Popen((executable, '-c', BENCHMARK_SERVER), cwd = self.targetDirectory, stdout = PIPE, stderr = null, universal_newlines = True)
+            link = 'http://127.0.0.1:%d/%s' % (int(server.stdout.readline()), BENCHMARK_FILE_NAME)
+            results = []
+            for name in DOWNLOADERS:
+                downloaderClass = DOWNLOADER_CLASSES[name]
+                try:
+                    downloaderClass.load()
+                except ImportError as e:
+                    self.logger.warning("%s: %s, SKIPPED", name, str(e).split('\n')[0])
+                    continue
+                if lexists(fileName):
+                    remove(fileName)
+                (startTime, startCPU) = (time(), sum(times()[:2]))
+                downloaderClass(link, fileName, BENCHMARK_SIZE, TITLE, (), self.timeout, ProgressIndicator(self.timeout),
+                                self.writeBufferSize or parseSize(DEFAULT_WRITE_BUFFER), self.syncPolicy).perform()
+                (duration, cpuTime) = (time() - startTime, sum(times()[:2]) - startCPU)
+                if getFileSize(fileName) != BENCHMARK_SIZE:
+                    raise DownloadError("%s downloaded %s instead of %s" % (name, readableSize(getFileSize(fileName) or 0), readableSize(BENCHMARK_SIZE)))
+                results.append((BENCHMARK_SIZE / duration, name, cpuTime * 1000 / (BENCHMARK_SIZE / 1024 / 1024)))
+            for (speed, name, cpuPerMB) in sorted(results, reverse = True):
+                self.logger.info("%s: %.1f MB/s, %.2f ms CPU per MB", name, speed / 1024 / 1024, cpuPerMB)
+        except Exception as e:
+            self.logger.error("Benchmark failed: %s", e)
+            self.errors += 1
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+            for name in (sourceName, fileName):
+                if lexists(name):
+                    remove(name)
+
+    def startBrowser(self):
+        '''Starts the main browser, logs in and starts the browser pool, unless they are running already.'''
+        if self.driver:
+            return
+        (self.driverName, self.driverClass) = getDriverClass(self.driverName)
+        if (self.getFileSizes or self.useDirectLinks) and not importRequests():
+            if self.renditionPolicy and self.renditionPolicy.needsSizes:
+                raise ValueError("--max-size and --budget require file sizes, which are not available")
+            self.getFileSizes = self.useDirectLinks = False
+        if self.revalidate and not importRequests(): # Conditional requests are made with Requests
+            raise ValueError("--revalidate requires Requests, which is not available")
+        self.logger.info("Starting %s...", self.driverName)
+        self.selectorRegistry = SelectorRegistry(self.targetDirectory)
+        if self.cacheTTL and self.maxItems is None and not self.pollTargets: # Listings cut short with --max-items are not cached, daemon polls always load them
+            self.listingCache = ListingCache(self.targetDirectory, self.cacheTTL)
+        self.driver = self.createDriver()
+        self.driverMonitor = DriverMonitor(self.recyclePages, self.recycleMemory, self.recycleLatency)
+        self.driverMonitor.reset(self.driver)
+        if self.credentials:
+            self.login(*self.credentials)
+            if not self.loggedIn:
+                raise ValueError("Aborting")
+        if self.workerCount > 1:
+            self.driverPool = DriverPool(self.createDriver, self.workerCount, self.pageController)
+
+    def crawl(self):
+        '''Crawls the start URLs and locates download links for all the videos found, returns the video jobs.'''
+        self.startBrowser()
+        startURLs = tuple(self.startURLs) or (None,)
+        for (n, url) in enumerate(startURLs, 1):
+            if len(startURLs) > 1:
+                self.logger.info("Start URL %d/%d: %s", n, len(startURLs), url)
+            (videoCount, errors) = (len(self.vIDs), self.errors)
+            self.doCreateFolders = False
+            try:
+                self.getItemsFromURL(url)
+            except Exception as e:
+                if len(startURLs) == 1:
+                    raise
+                self.logger.error(format_exc() if self.verbose else e)
+                self.errors += 1
+            self.batchResults.append((url, len(self.vIDs) - videoCount, self.errors - errors))
+        if self.folders:
+            self.logger.info("Got total of %d folders", len(self.folders))
+        if not self.vIDs:
+            return ()
+        assert len(self.vIDs) == len(set(self.vIDs))
+        self.logger.info("Processing %d videos...", len(self.vIDs))
+        # Sizes are needed before downloading only if the crawl doesn't download them now, or the downloader doesn't report them
+        self.probeSizes = self.getFileSizes and (not self.doDownload or bool(self.manifestFileName or self.queueFileName) or self.downloaderName == GrabberDownload.NAME)
+        if self.getFileSizes:
+            requests.adapters.DEFAULT_RETRIES = self.retryCount
+        if self.useDirectLinks and not self.linkResolver: # The session is kept between daemon polls
+            self.userAgent = str(self.driver.execute_script('return window.navigator.userAgent'))
+            self.cookies = self.driver.get_cookies()
+            self.linkResolver = LinkResolver(sessionFetcher(createSession(self.userAgent, self.cookies), self.timeout or None, self.pageController, self.retryCount))
+        jobs = tuple(job if self.resolveFromIndex(job) else self.resolveVideo(job) for job in (VideoJob(vID, n) for (n, vID) in enumerate(sorted(self.vIDs, reverse = True), 1)))
+        if self.manifestFileName:
+            self.writeManifest(jobs)
+        return jobs
+
+    def runDaemon(self):
+        '''Polls the daemon targets when they are due, until interrupted.
+
+        The browser, its login, the download session and the library index are kept between polls.'''
+        self.daemonStarted = time()
+        if self.statusPort:
+            self.statusServer = startStatusServer(self.statusPort, self.getDaemonStatus)
+            self.logger.info("Serving daemon status at http://127.0.0.1:%d/", self.statusPort)
+        self.logger.info("Daemon started, polling %d start URLs", len(self.pollTargets))
+        try:
+            while True:
+                now = time()
+                targets = [target for target in self.pollTargets if target.nextPoll <= now]
+                if targets:
+                    self.poll(targets)
+                else:
+                    self.daemonState = 'idle'
+                    sleep(min(target.nextPoll for target in self.pollTargets) - now)
+        except KeyboardInterrupt:
+            self.logger.info("Daemon stopped")
+
+    def poll(self, targets):
+        '''Crawls the due daemon targets and downloads their new or changed videos.'''
+        self.daemonState = 'polling'
+        self.pollCount += 1
+        (self.vIDs, self.folders, self.crawledListings, self.batchResults, self.totalFileSize) = ([], [], {}, [], 0)
+        self.startURLs = [target.url for target in targets]
+        errors = self.errors
+        self.logger.info("Poll %d: %s", self.pollCount, ', '.join('%s' % target.url for target in targets))
+        try:
+            jobs = self.crawl()
+            crawlComplete = self.errors == errors # Folder members missed by a failed listing page must keep their links
+            newJobs = tuple(job for job in jobs if not job.downloaded) # Complete according to the library index
+            self.queuedCount += len(newJobs)
+            if newJobs:
+                self.logger.info("Queued %d new or changed videos of %d", len(newJobs), len(jobs))
+                self.daemonState = 'downloading'
+                self.planStorage(newJobs)
+                self.processJobs(newJobs)
+            self.linkFolders(jobs, crawlComplete)
+        except Exception as e:
+            self.logger.error(format_exc() if self.verbose else e)
+            self.errors += 1
+        results = dict((url, (videoCount, errorCount)) for (url, videoCount, errorCount) in self.batchResults)
+        for target in targets:
+            target.schedule(*results.get(target.url, (0, self.errors - errors)))
+        nextPoll = min(target.nextPoll for target in self.pollTargets)
+        self.logger.info("Poll %d completed%s, next poll at %s", self.pollCount, ' with %d errors' % (self.errors - errors) if self.errors > errors else '', formatTime(nextPoll))
+
+    def getDaemonStatus(self):
+        return {'state': self.daemonState, 'started': formatTime(self.daemonStarted), 'polls': self.pollCount, 'queued': self.queuedCount, 'errors': self.errors,
+                'targets': [target.getStatus() for target in self.pollTargets]}
+
+    def writeManifest(self, jobs):
+        self.logger.info("Writing manifest %s", self.manifestFileName)
+        with open(self.manifestFileName, 'w') as f:
+            for job in jobs:
+                f.write(dumps(job.getRecord(self.getJobFolders(job))) + '\n')
+
+    def readManifest(self):
+        '''Reads video jobs and folders from a manifest written with --manifest.'''
+        self.logger.info("Reading manifest %s", self.manifestSource)
+        jobs = []
+        folders = {}
+        with open(self.manifestSource) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = loads(line)
+                job = VideoJob.fromRecord(record, len(jobs) + 1)
+                job.targetFileName = self.getTargetFileName(job.fileName)
+                job.downloaded = self.isComplete(job)
+                self.totalFileSize += job.linkSize or 0
+                jobs.append(job)
+                for folder in record.get('folders', ()):
+                    folders.setdefault(folder, set()).add(job.vID)
+        self.vIDs = [job.vID for job in jobs]
+        assert len(self.vIDs) == len(set(self.vIDs))
+        if self.foldersNeeded:
+            self.folders = [(self.createDir(folder), vIDs) for (folder, vIDs) in sorted(folders.items())]
+        self.logger.info("Got %d videos (%s) and %d folders", len(jobs), readableSize(self.totalFileSize), len(folders))
+        return tuple(jobs)
+
     def run(self):
         self.doCreateFolders = False
         self.loggedIn = False
         self.vIDs = []
         self.folders = []
+        self.crawledListings = {} # {URL: (title, items)} of the listings loaded in this crawl
+        self.batchResults = [] # (start URL, new videos, errors)
         self.totalFileSize = 0
+        self.deferredCount = 0
+        self.deferredSize = 0
+        self.revalidation = dict.fromkeys(REVALIDATION_RESULTS, 0)
         self.errors = 0
+        if self.benchmark:
+            getattr(self, 'benchmark' + self.benchmark.capitalize())()
+            return self.errors
+        if self.migrateLayout:
+            self.migrate()
+            return self.errors
         try:
-            self.logger.info("Starting %s...", self.driverName)
-            self.driver = self.driverClass() # ToDo: Provide parameters to the driver
-            if self.credentials:
-                self.login(*self.credentials)
-                if not self.loggedIn:
-                    raise ValueError("Aborting")
-            self.getItemsFromURL(self.startURL)
-            if self.folders:
-                self.logger.info("Got total of %d folders", len(self.folders))
-            if self.vIDs:
-                assert len(self.vIDs) == len(set(self.vIDs))
-                self.logger.info("Processing %d videos...", len(self.vIDs))
-                if self.getFileSizes:
-                    requests.adapters.DEFAULT_RETRIES = self.retryCount
-                for (n, vID) in enumerate(sorted(self.vIDs, reverse = True), 1):
-                    self.processVideo(vID, n)
-        except Exception, e:
+            self.pageController = ConcurrencyController("Page loads", self.workerCount, self.logger)
+            self.downloadController = ConcurrencyController("Downloads", self.downloadCount, self.logger)
+            if self.useIndex:
+                self.libraryIndex = LibraryIndex(self.targetDirectory, self.sharded)
+                self.logger.info("Library index: %d video files, %d recorded complete", len(self.libraryIndex.files), len(self.libraryIndex.records))
+            if self.pollTargets:
+                self.runDaemon()
+                jobs = ()
+            else:
+                errors = self.errors
+                jobs = self.readManifest() if self.manifestSource else self.crawl() if self.startURLs or self.credentials else ()
+                crawlComplete = self.errors == errors and self.maxItems is None # Folder members missed by a failed listing page or --max-items must keep their links
+            if self.queueFileName:
+                queue = WorkQueue(self.queueFileName)
+                if jobs:
+                    self.logger.info("Adding %d videos to work queue %s", len(jobs), self.queueFileName)
+                    queue.add(job.getRecord(self.getJobFolders(job)) for job in jobs)
+                if self.driverPool: # Browsers are not needed any more
+                    self.driverPool.close()
+                self.processQueue(queue)
+            elif jobs:
+                self.planStorage(jobs)
+                self.processJobs(jobs)
+                self.linkFolders(jobs, crawlComplete)
+                if self.reportFileName:
+                    self.reconcileLibrary(jobs)
+        except Exception as e:
             self.logger.error(format_exc() if self.verbose else e)
             self.errors += 1
         finally:
+            if self.statusServer:
+                self.statusServer.shutdown()
+                self.statusServer.server_close()
+            if self.driverPool:
+                self.driverPool.close()
             if self.driver:
                 self.driver.close()
+            if self.selectorRegistry:
+                self.selectorRegistry.save()
+        logContext.set(phase = 'report')
         self.logger.info("Crawling completed" + (' with %d errors' % self.errors if self.errors else ''))
+        if self.pollTargets:
+            self.logger.info('\n'.join(["Daemon ran %d polls, queued %d videos:" % (self.pollCount, self.queuedCount)]
+                                      + ["%6d polls, last %s: %d videos%s  %s" % (target.polls, formatTime(target.lastPoll), target.videos, ', %d errors' % target.errors if target.errors else '', target.url) for target in self.pollTargets]))
+        elif len(self.batchResults) > 1:
+            self.logger.info('\n'.join(["Batch of %d start URLs, %d videos:" % (len(self.batchResults), len(self.vIDs))]
+                                      + ["%6d new videos%s  %s" % (videoCount, ', %d errors' % errors if errors else '', url) for (url, videoCount, errors) in self.batchResults]))
+        if self.renditionPolicy:
+            self.logger.info(self.renditionPolicy.getReport())
+        if self.deferredCount:
+            self.logger.info("Deferred %d downloads (%s) for lack of free space", self.deferredCount, readableSize(self.deferredSize))
+        if self.revalidate:
+            self.logger.info("Revalidation: %s", ', '.join('%d %s' % (self.revalidation[result], result) for result in REVALIDATION_RESULTS))
+        for controller in (self.pageController, self.downloadController):
+            if controller and controller.adjustments:
+                self.logger.info(controller.getReport())
+        if self.driverMonitor and self.driverMonitor.restarts:
+            self.logger.info(self.driverMonitor.getReport())
+        if self.tracer and self.tracer.records:
+            self.logger.info(self.tracer.getReport())
         self.removeDuplicates()
         return self.errors
 
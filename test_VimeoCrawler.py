@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+'''Tests of the crawler that need neither a browser nor the network.'''
+from hashlib import md5
+from json import dumps
+from logging import getLogger
+from os import listdir, makedirs, stat
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+try:
+    from urllib.parse import quote # pylint: disable=E0611, F0401
+except ImportError:
+    from urllib import quote # pylint: disable=E0611
+
+from VimeoCrawler import DOWNLOAD_CONFIG_URL, LISTING_CACHE_FILE_NAME, OEMBED_URL, SHARD_DIRECTORY_NAME, VIMEO_URL, DriverTracer, FileWriter, LinkReconciler, LinkResolver, ListingCache, VimeoCrawler, WorkQueue, getShard, getStoragePath, scanLibrary
+
+class OptionsTest(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def testDefaults(self):
+        crawler = VimeoCrawler(['-d', self.directory, '123'])
+        self.assertEqual([url.vID for url in crawler.startURLs], [123])
+        self.assertEqual(crawler.tracer, None)
+
+    def testTrace(self):
+        crawler = VimeoCrawler(['--trace', '-d', self.directory, '123'])
+        self.assertTrue(isinstance(crawler.tracer, DriverTracer))
+
+class FileWriterTest(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.fileName = join(self.directory, 'V 1.mp4')
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def testChecksum(self):
+        writer = FileWriter(self.fileName, 200000, 0, 1024)
+        for _ in range(4):
+            writer.write(b'b' * 50000)
+        writer.close()
+        with open(self.fileName, 'rb') as f:
+            self.assertEqual(writer.checksum.hexdigest(), md5(f.read()).hexdigest())
+
+    def testResumedWithoutChecksum(self):
+        with open(self.fileName, 'wb') as f:
+            f.write(b'a' * 100000)
+        writer = FileWriter(self.fileName, 300000, 100000, 1024)
+        writer.write(b'b' * 200000)
+        writer.close()
+        self.assertEqual(writer.checksum, None)
+        self.assertEqual(stat(self.fileName).st_size, 300000)
+
+class LinkResolverTest(TestCase):
+    CONFIG = { 'clip': { 'title': 'Some video' },
+               'files': [{ 'public_name': 'SD', 'extension': 'mp4', 'size': '1000', 'download_url': 'https://example.com/sd.mp4?token=1' },
+                         { 'public_name': 'HD', 'size': '2.5 MB', 'link': 'https://example.com/hd.mp4?token=1' },
+                         { 'public_name': 'Mobile', 'size': 300 },
+                         { 'public_name': 'Mobile', 'size': 300, 'download_url': 'https://example.com/mobile.mp4' }],
+               'source_file': { 'extension': 'mov', 'size': 5000, 'download_url': 'https://example.com/original.mov', 'codec': 'ProRes' } }
+
+    def resolve(self, vID, fixtures):
+        fixtures = dict((url, dumps(data)) for (url, data) in fixtures.items())
+        self.fetched = []
+        def fetch(url):
+            self.fetched.append(url)
+            return fixtures[url]
+        return LinkResolver(fetch).resolve(vID)
+
+    def testRenditions(self):
+        (title, renditions) = self.resolve(1, { DOWNLOAD_CONFIG_URL % 1: self.CONFIG })
+        self.assertEqual(title, 'Some video')
+        self.assertEqual([(r.quality, r.extension, r.size, r.codec) for r in renditions],
+                         [('Original', 'mov', 5000, 'ProRes'), ('HD', 'mp4', None, None), ('SD', 'mp4', 1000, None), ('Mobile', 'mp4', 300, None)])
+        self.assertEqual(self.fetched, [DOWNLOAD_CONFIG_URL % 1])
+
+    def testOEmbedTitle(self):
+        config = dict(self.CONFIG, clip = {})
+        (title, renditions) = self.resolve(2, { DOWNLOAD_CONFIG_URL % 2: config, OEMBED_URL % quote(VIMEO_URL % 2, ''): { 'title': 'Embedded title' } })
+        self.assertEqual((title, len(renditions)), ('Embedded title', 4))
+
+    def testNoFiles(self):
+        self.assertRaises(ValueError, self.resolve, 3, { DOWNLOAD_CONFIG_URL % 3: { 'clip': { 'title': 'Private' }, 'files': [] } })
+
+class LinkReconcilerTest(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        makedirs(join(self.directory, 'Album'))
+        for fileName in ('V 2.mp4', 'V 3.mp4'):
+            with open(join(self.directory, fileName), 'w') as f:
+                f.write(fileName)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def testMissingFileKeepsHardLinks(self):
+        reconciler = LinkReconciler(self.directory, True, getLogger('vimeo'))
+        reconciler.reconcile(join(self.directory, 'Album'), {1: 'V 1.mp4', 2: 'V 2.mp4', 3: 'V 3.mp4'}, set((1, 2, 3)), True)
+        self.assertEqual(sorted(listdir(join(self.directory, 'Album'))), ['V 2.mp4', 'V 3.mp4'])
+        self.assertEqual((reconciler.counts['missing'], reconciler.methods['hardlink']), (1, 2))
+        self.assertEqual(stat(join(self.directory, 'Album', 'V 3.mp4')).st_nlink, 2)
+
+class LibraryLayoutTest(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def testUntitledStoragePath(self):
+        self.assertEqual(getStoragePath('123.none', True), join(SHARD_DIRECTORY_NAME, getShard(123), '123.none'))
+        self.assertEqual(getStoragePath('Title 2019 123.mp4', True), join(SHARD_DIRECTORY_NAME, getShard(123), 'Title 2019 123.mp4'))
+
+    def testScanSkipsDirectories(self):
+        makedirs(join(self.directory, 'Album 2019.final'))
+        for fileName in ('V 1.mp4', '2.none', 'source.url'):
+            with open(join(self.directory, fileName), 'w') as f:
+                f.write(fileName)
+        self.assertEqual(scanLibrary(self.directory), {1: ['V 1.mp4'], 2: ['2.none']})
+
+class ListingCacheTest(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def testBrokenLineCompacted(self):
+        ListingCache(self.directory, 3600).put(VIMEO_URL % 'album/1', 'Album', (1, 2))
+        with open(join(self.directory, LISTING_CACHE_FILE_NAME), 'a') as f:
+            f.write('{"url": "https://vimeo.com/al')
+        self.assertEqual(ListingCache(self.directory, 3600).get(VIMEO_URL % 'album/1')['items'], ['1', '2'])
+        with open(join(self.directory, LISTING_CACHE_FILE_NAME)) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+class WorkQueueTest(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def testReAddingKeepsLiveLease(self):
+        (queueA, queueB) = (WorkQueue(join(self.directory, 'queue')), WorkQueue(join(self.directory, 'queue')))
+        record = {'vID': 1, 'fileName': 'V 1.mp4', 'title': 'V', 'link': 'http://example.com/1.mp4', 'folders': []}
+        queueA.add([record])
+        self.assertEqual(queueA.claim('A')['vID'], 1)
+        queueB.add([record])
+        self.assertEqual(queueB.claim('B'), None)
+        self.assertTrue(queueA.renew(1, 'A'))
+
+if __name__ == '__main__':
+    main()